@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+'''Microbenchmark of Record name lookup on wide rows
+
+    python benchmarks/bench_records.py
+'''
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from zwdb.records import RecordCollection
+
+COLS = 60
+ROWS = 2000
+
+def linear_lookup(rec, key):
+    '''Name lookup as done before the shared index: two scans of the keys'''
+    keys = rec.keys()
+    if key in keys:
+        i = keys.index(key)
+        if keys.count(key) > 1:
+            raise KeyError(key)
+        return rec.values()[i]
+    raise KeyError(key)
+
+def main():
+    keys = ['col%02d' % i for i in range(COLS)]
+    rows = [tuple(range(i, i+COLS)) for i in range(ROWS)]
+    recs = RecordCollection(keys, iter(rows)).all()
+    lookups = keys[-10:]
+
+    def run_linear():
+        for rec in recs:
+            for k in lookups:
+                linear_lookup(rec, k)
+
+    def run_index():
+        for rec in recs:
+            for k in lookups:
+                rec[k]
+
+    def run_attr():
+        for rec in recs:
+            for k in lookups:
+                getattr(rec, k)
+
+    n = ROWS * len(lookups)
+    print('%d columns, %d lookups per run' % (COLS, n))
+    for name, fn in (('linear scan', run_linear), ('index getitem', run_index), ('index getattr', run_attr)):
+        t = min(timeit.repeat(fn, number=5, repeat=3)) / 5
+        print('%-14s %8.1f ns/lookup' % (name, t / n * 1e9))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+'''A MySQL-compatible test double: a server speaking the MySQL client/server protocol
+(handshake, COM_QUERY text result sets, COM_PING, COM_RESET_CONNECTION) on localhost,
+with queries run by sqlite on a temporary database file.
+
+Any user and password are accepted. Only the part of MySQL that sqlite also parses
+works, plus SET, SHOW TABLES, SELECT @@var, FROM DUAL and the transaction statements,
+which is enough for the backend test and benchmark. Both mysql-connector backends talk
+to it over a real socket, so the protocol handling being compared is their own.
+
+    with MysqlStub() as stub:
+        db = ZWMysql(stub.url)
+'''
+import os
+import re
+import socket
+import sqlite3
+import struct
+import tempfile
+import threading
+import socketserver
+
+SERVER_VERSION = '8.0.36-zwdb-stub'
+SERVER_VARS = {'max_allowed_packet': 64 * 1024 * 1024, 'version': SERVER_VERSION, 'autocommit': 1}
+# protocol 41, secure connection, plugin auth, multi statements/results, transactions, connect with db
+CAPABILITIES = 0x0001 | 0x0002 | 0x0004 | 0x0008 | 0x0200 | 0x2000 | 0x8000 | 0x10000 | 0x20000 | 0x80000
+STATUS_AUTOCOMMIT = 0x0002
+STATUS_IN_TRANS = 0x0001
+COM_QUIT, COM_INIT_DB, COM_QUERY, COM_PING, COM_RESET_CONNECTION = 0x01, 0x02, 0x03, 0x0e, 0x1f
+# column types and charsets of the text protocol
+TYPE_DOUBLE, TYPE_NULL, TYPE_LONGLONG, TYPE_BLOB, TYPE_VAR_STRING = 0x05, 0x06, 0x08, 0xfc, 0xfd
+CHARSET_UTF8MB4, CHARSET_BINARY = 45, 63
+ROWS_PER_WRITE = 1000
+
+RE_SQL_STRING = re.compile(r"'((?:[^'\\]|\\.|'')*)'", re.S)
+RE_ESCAPE = re.compile(r'\\(.)', re.S)
+RE_SERVER_VAR = re.compile(r'^\s*SELECT\s+@@(?:session\.|global\.)?(\w+)\s*$', re.I)
+# sqlite takes SELECT ... WHERE without a table
+RE_DUAL = re.compile(r'\s+FROM\s+DUAL\b', re.I)
+ESCAPES = {'0': '\0', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a', 'b': '\b'}
+
+def _lenenc_int(n):
+    if n < 251:
+        return struct.pack('<B', n)
+    if n < 1 << 16:
+        return b'\xfc' + struct.pack('<H', n)
+    if n < 1 << 24:
+        return b'\xfd' + struct.pack('<I', n)[:3]
+    return b'\xfe' + struct.pack('<Q', n)
+
+def _lenenc_str(b):
+    return _lenenc_int(len(b)) + b
+
+def _sqlite_literal(m):
+    # mysql backslash escapes to a sqlite string literal
+    s = RE_ESCAPE.sub(lambda e: ESCAPES.get(e.group(1), e.group(1)), m.group(1).replace("''", "'"))
+    return "'" + s.replace("'", "''") + "'"
+
+def _column_type(vals):
+    for v in vals:
+        if isinstance(v, int):
+            return TYPE_LONGLONG, CHARSET_BINARY
+        if isinstance(v, float):
+            return TYPE_DOUBLE, CHARSET_BINARY
+        if isinstance(v, bytes):
+            return TYPE_BLOB, CHARSET_BINARY
+        if v is not None:
+            return TYPE_VAR_STRING, CHARSET_UTF8MB4
+    return TYPE_NULL, CHARSET_BINARY
+
+def _text_value(v):
+    if v is None:
+        return b'\xfb'
+    if isinstance(v, bytes):
+        return _lenenc_str(v)
+    if isinstance(v, float):
+        return _lenenc_str(repr(v).encode())
+    return _lenenc_str(str(v).encode('utf-8'))
+
+class MysqlStubHandler(socketserver.BaseRequestHandler):
+    """One client connection, one sqlite connection"""
+    def setup(self):
+        self.seq = 0
+        self.db = sqlite3.connect(self.server.dbpath, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA busy_timeout=30000')
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.request.makefile('rb')
+
+    def finish(self):
+        self.rfile.close()
+        self.db.close()
+
+    def handle(self):
+        try:
+            self.serve()
+        except (ConnectionError, OSError):
+            # the client dropped the connection, maybe in the middle of a result
+            pass
+
+    def serve(self):
+        self.handshake()
+        while True:
+            payload = self.read_packet()
+            if not payload or payload[0] == COM_QUIT:
+                return
+            cmd, arg = payload[0], payload[1:]
+            if cmd == COM_QUERY:
+                self.query(arg.decode('utf-8'))
+            elif cmd in (COM_PING, COM_INIT_DB):
+                self.send_ok()
+            elif cmd == COM_RESET_CONNECTION:
+                if self.db.in_transaction:
+                    self.db.rollback()
+                self.send_ok()
+            else:
+                self.send_error(1047, '08S01', 'Unknown command {}'.format(cmd))
+
+    def read_packet(self):
+        payload = b''
+        while True:
+            head = self.rfile.read(4)
+            if len(head) < 4:
+                return None
+            size = head[0] | head[1] << 8 | head[2] << 16
+            self.seq = (head[3] + 1) % 256
+            payload += self.rfile.read(size)
+            if size < 0xffffff:
+                return payload
+
+    def packet(self, payload):
+        out = b''
+        while True:
+            chunk, payload = payload[:0xffffff], payload[0xffffff:]
+            out += struct.pack('<I', len(chunk))[:3] + struct.pack('<B', self.seq) + chunk
+            self.seq = (self.seq + 1) % 256
+            if len(chunk) < 0xffffff:
+                return out
+
+    def handshake(self):
+        scramble = os.urandom(20)
+        payload = (b'\x0a' + SERVER_VERSION.encode() + b'\0' + struct.pack('<I', threading.get_ident() & 0xffffffff)
+            + scramble[:8] + b'\0' + struct.pack('<H', CAPABILITIES & 0xffff) + struct.pack('<B', CHARSET_UTF8MB4)
+            + struct.pack('<H', STATUS_AUTOCOMMIT) + struct.pack('<H', CAPABILITIES >> 16) + struct.pack('<B', 21)
+            + b'\0' * 10 + scramble[8:] + b'\0' + b'mysql_native_password\0')
+        self.request.sendall(self.packet(payload))
+        # any credentials are fine
+        self.read_packet()
+        self.send_ok()
+
+    def status(self):
+        return STATUS_IN_TRANS if self.db.in_transaction else STATUS_AUTOCOMMIT
+
+    def send_ok(self, affected=0, insert_id=0):
+        self.request.sendall(self.packet(b'\0' + _lenenc_int(affected) + _lenenc_int(insert_id)
+            + struct.pack('<HH', self.status(), 0)))
+
+    def send_error(self, code, state, msg):
+        self.request.sendall(self.packet(b'\xff' + struct.pack('<H', code) + b'#' + state.encode() + msg.encode('utf-8')))
+
+    def eof(self):
+        return self.packet(b'\xfe' + struct.pack('<HH', 0, self.status()))
+
+    def query(self, sql):
+        stmt = sql.strip().rstrip(';')
+        verb = stmt.split(None, 1)[0].upper() if stmt else ''
+        m = RE_SERVER_VAR.match(stmt)
+        if m:
+            self.send_rows(['@@' + m.group(1)], [(SERVER_VARS.get(m.group(1).lower()),)])
+            return
+        if verb == 'SET':
+            self.send_ok()
+            return
+        if verb == 'SHOW' and stmt.upper().split()[:2] == ['SHOW', 'TABLES']:
+            stmt = "SELECT name AS Tables_in_stub FROM sqlite_master WHERE type='table' ORDER BY name"
+        elif verb in ('START', 'BEGIN'):
+            # mysql commits an open transaction first
+            if self.db.in_transaction:
+                self.db.commit()
+            stmt = 'BEGIN'
+        elif verb in ('COMMIT', 'ROLLBACK') and not self.db.in_transaction:
+            self.send_ok()
+            return
+        try:
+            cursor = self.db.execute(RE_DUAL.sub('', RE_SQL_STRING.sub(_sqlite_literal, stmt)))
+        except sqlite3.Error as e:
+            if 'no such table' in str(e):
+                self.send_error(1146, '42S02', str(e))
+            else:
+                self.send_error(1064, '42000', str(e))
+            return
+        if cursor.description is None:
+            self.send_ok(max(cursor.rowcount, 0), cursor.lastrowid or 0)
+        else:
+            self.send_rows([d[0] for d in cursor.description], cursor)
+
+    def send_rows(self, names, rows):
+        rows = iter(rows)
+        first = [r for _, r in zip(range(ROWS_PER_WRITE), rows)]
+        out = self.packet(_lenenc_int(len(names)))
+        for i, name in enumerate(names):
+            typ, charset = _column_type(r[i] for r in first)
+            name = name.encode('utf-8')
+            out += self.packet(_lenenc_str(b'def') + b'\0\0\0' + _lenenc_str(name) + _lenenc_str(name)
+                + b'\x0c' + struct.pack('<HIBHB', charset, 255, typ, 0, 0) + b'\0\0')
+        out += self.eof()
+        while first:
+            for r in first:
+                out += self.packet(b''.join(_text_value(v) for v in r))
+            self.request.sendall(out)
+            out = b''
+            first = [r for _, r in zip(range(ROWS_PER_WRITE), rows)]
+        self.request.sendall(out + self.eof())
+
+class MysqlStub(socketserver.ThreadingTCPServer):
+    """Serve the stub on a free localhost port in a background thread until closed"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.dbpath = os.path.join(self._tmpdir.name, 'stub.db')
+        with sqlite3.connect(self.dbpath) as db:
+            db.execute('PRAGMA journal_mode=WAL')
+        db.close()
+        super().__init__((host, port), MysqlStubHandler)
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    url = property(lambda self: 'mysql://stub:stub@{}:{}/stub'.format(*self.server_address))
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        self._tmpdir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, val, traceback):
+        self.close()
@@ -129,6 +129,8 @@ def test_insert(db):
     assert r
     r = db.insert(INDEX_NM, {'id': 2})
     assert not r
+    r = db.insert(INDEX_NM, ({'id': i, 'num': i} for i in (2, 20, 21)), chunk_size=2, refresh=True)
+    assert r == 2 and db.delete(INDEX_NM, docid=20) and db.delete(INDEX_NM, docid=21, refresh=True)
 
 def test_update(db):
     title = '测试照地球南博万。。刘德华'
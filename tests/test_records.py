@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import pytest
+from zwdb.records import Record, RecordCollection, ZwdbError
+
+KEYS = ['id', 'txt', 'num']
+ROWS = [(1, 'txt1', 1.0), (2, 'txt2', 2.0), (3, 'txt3', 3.0)]
+
+def test_record_lookup():
+    rs = RecordCollection(KEYS, iter(ROWS))
+    recs = rs.all()
+    assert recs[1].txt == 'txt2' and recs[1]['num'] == 2.0 and recs[1][0] == 2
+    assert recs[0]._index is recs[2]._index
+    assert [r.txt for r in rs[1:]] == ['txt2', 'txt3']
+    with pytest.raises(KeyError):
+        _ = recs[0]['missing']
+    with pytest.raises(AttributeError):
+        _ = recs[0].missing
+
+def test_record_duplicate_fields():
+    rec = RecordCollection(['id', 'txt', 'id'], iter([(1, 'a', 2)]))[0]
+    assert rec.txt == 'a' and rec.get('id') is None
+    with pytest.raises(KeyError, match='multiple'):
+        _ = rec['id']
+
+def test_record_from_dict():
+    rec = Record(o={'id': 1, 'txt': 'abc'})
+    assert rec.txt == 'abc' and rec.as_dict() == {'id': 1, 'txt': 'abc'}
+
+def test_stream():
+    rs = RecordCollection(KEYS, iter(ROWS), stream=True)
+    assert rs[1].txt == 'txt2' and len(rs) == 2
+    with pytest.raises(ZwdbError, match='consumed'):
+        _ = rs[0]
+    recs = list(rs)
+    assert len(recs) == 1 and recs[0].id == 3 and not rs._all_rows
+    assert list(rs) == [] and rs.pending is False
+    with pytest.raises(IndexError):
+        _ = rs[3]
+
+def test_stream_slice():
+    rs = RecordCollection(KEYS, iter(ROWS), stream=True)
+    sub = rs[1:3]
+    assert [r.id for r in sub] == [2, 3] and not rs._all_rows
+    with pytest.raises(ZwdbError):
+        _ = rs[-1]
+
+def test_to_columns():
+    rs = RecordCollection(KEYS, iter(ROWS))
+    assert rs[0].id == 1
+    cols = rs.to_columns(typecodes={'id': 'q'}, batch_size=2)
+    assert list(cols['id']) == [1, 2, 3] and cols['id'].typecode == 'q'
+    assert cols['txt'] == ['txt1', 'txt2', 'txt3'] and rs.pending is False
+    # rows read by to_columns are not cached, later access must not see a truncated set
+    with pytest.raises(ZwdbError):
+        len(rs)
+    with pytest.raises(ZwdbError):
+        rs.all()
+    # a fully cached collection keeps working
+    rs = RecordCollection(KEYS, iter(ROWS))
+    assert len(rs.all()) == 3 and rs.to_columns()['id'] == [1, 2, 3] and len(rs) == 3
+
+def test_to_numpy():
+    np = pytest.importorskip('numpy')
+    arrs = RecordCollection(KEYS, iter(ROWS)).to_numpy(dtypes={'num': 'f4'})
+    assert arrs['num'].dtype == np.float32 and arrs['id'].sum() == 6
+    recs = RecordCollection(KEYS, iter(ROWS)).to_numpy(structured=True)
+    assert recs.txt[1] == 'txt2' and len(recs) == 3
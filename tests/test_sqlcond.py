@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import pytest
+from zwdb import sqlcond
+
+@pytest.mark.parametrize(
+    'params, paramstyle, sql, args', (
+        ({'num': 1}, 'named', 'num=:num AND 1=1', {'num': 1}),
+        ({'none': None}, 'named', '(none IS NULL) AND 1=1', {}),
+        ({'none': None}, 'pyformat', '(ISNULL(none)) AND 1=1', {}),
+        ({'txt': {'LIKE': 'a%'}}, 'pyformat', '(txt LIKE %(_w0)s) AND 1=1', {'_w0': 'a%'}),
+        ({'num': {'or': (2, 3)}, 'txt': 'a'}, 'named', '(num=:_w0 OR num=:_w1) AND txt=:txt AND 1=1', {'_w0': 2, '_w1': 3, 'txt': 'a'}),
+        ({'num': {'range': (1, 3)}, 'id': {'>': 5}}, 'named', '(num>=:_w0 AND num<:_w1) AND (id > :_w2) AND 1=1', {'_w0': 1, '_w1': 3, '_w2': 5}),
+        ({'dt': {'raw': 'IS NOT NULL'}}, 'named', '(dt IS NOT NULL) AND 1=1', {}),
+    )
+)
+def test_compile_wheres(params, paramstyle, sql, args):
+    assert sqlcond.compile_wheres(params, paramstyle) == (sql, args)
+
+def test_compile_keyflds():
+    sql, args = sqlcond.compile_keyflds(['id', {'none': None}, {'num': {'<': 9}}], 'named')
+    assert sql == 'id=:id AND (none IS NULL) AND (num < :_w0) AND 1=1' and args == {'_w0': 9}
+
+def test_compile_keyflds_duplicated_field():
+    sql, args = sqlcond.compile_keyflds(['num', {'num': {'<': 9}}], 'named')
+    assert sql == 'num=:num AND (num < :_w0) AND 1=1' and args == {'_w0': 9}
+    sql, args = sqlcond.compile_keyflds([{'num': {'>': 1}}, 'num', {'num': {'<': 9}}], 'pyformat')
+    assert sql == '(num > %(_w0)s) AND num=%(num)s AND (num < %(_w1)s) AND 1=1'
+    assert args == {'_w0': 1, '_w1': 9}
+
+def test_template_cache():
+    sqlcond.cache_clear()
+    s1, a1 = sqlcond.compile_wheres({'num': {'>': 1}, 'txt': 'a'}, 'named')
+    s2, a2 = sqlcond.compile_wheres({'num': {'>': 2}, 'txt': 'b'}, 'named')
+    info = sqlcond.cache_info()
+    assert s1 == s2 and a1 != a2 and info.hits == 1 and info.misses == 1
@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 # pylint: disable=redefined-outer-name
 
+import time
+import threading
 import pytest
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from zwdb import zwsqlite
 from zwdb.zwsqlite import ZWSqlite
+from zwdb.records import ZwdbError
 
 DB_URL = 'file:./data/test.db'
 SQL_PTH = './data/tbl_create_sqlite.sql'
@@ -80,6 +85,24 @@ def test_find(db):
     recs = db.find(tbl, num={'or': (2, 3)}, fetchall=True)
     assert len(recs) == 2
 
+    rs = db.find(tbl, clause={'ORDER BY num': 'ASC'}, stream=True)
+    recs = [r.num for r in rs]
+    assert recs == [1.0, 2.0, 3.0] and len(rs._all_rows) == 0
+    with pytest.raises(ZwdbError):
+        _ = rs[0]
+
+    rs = db.find(tbl, clause={'ORDER BY num': 'ASC'}, arraysize=2)
+    assert [r.num for r in rs] == [1.0, 2.0, 3.0]
+
+    cols = db.find(tbl, clause={'ORDER BY num': 'ASC'}).to_columns(typecodes={'num': 'd'}, batch_size=2)
+    assert list(cols['num']) == [1.0, 2.0, 3.0] and cols['txt'][0] == 'txt1'
+
+    # a new query drops the rows buffered for a partly read result
+    with db.get_connection() as conn:
+        rs = conn.find(tbl, arraysize=2)
+        assert rs[0].id and conn.count(tbl) == 3
+        assert [r.num for r in conn.find(tbl, clause={'ORDER BY num': 'ASC'})] == [1.0, 2.0, 3.0]
+
 def test_findone(db):
     tbl = TBLS[0]
     r = db.findone(tbl, clause={'ORDER BY num': 'DESC'}, num={'>': 1})
@@ -114,6 +137,43 @@ def test_upsert(db):
     r = db.findone(tbl, id=1)
     assert ic == 2 and uc == 1 and r.txt == 'txt1' and r.num == 1
 
+def test_upsert_composite(db):
+    tbl = 'tbl_upsert'
+    with db.get_connection() as conn:
+        conn.execute('CREATE TABLE %s (txt VARCHAR(45), num INTEGER, val FLOAT, UNIQUE(txt, num))' % tbl, commit=True)
+    try:
+        recs = [{'txt': 'a', 'num': i, 'val': i} for i in range(1500)]
+        assert db.upsert(tbl, recs, keyflds=['txt', 'num']) == (1500, 0)
+        recs = [{'txt': 'a', 'num': 1, 'val': 9}, {'txt': 'b', 'num': 1, 'val': 8}, {'txt': 'b', 'num': 1, 'val': 7}]
+        assert db.upsert(tbl, recs, keyflds=['txt', 'num']) == (1, 2)
+        assert db.findone(tbl, txt='a', num=1).val == 9 and db.findone(tbl, txt='b').val == 7
+        # a text num hits the existing integer key, counted as the update it is
+        assert db.upsert(tbl, [{'txt': 'a', 'num': '1', 'val': 6}], keyflds=['txt', 'num']) == (0, 1)
+        # no unique index on val, falls back to row-wise upsert
+        assert db.upsert(tbl, [{'txt': 'c', 'num': 1, 'val': 0.5}], keyflds=['val']) == (1, 0)
+        assert db.upsert(tbl, [{'txt': 'c', 'num': 2, 'val': 0.5}], keyflds=['val']) == (0, 1)
+        assert db.count(tbl) == 1502
+    finally:
+        with db.get_connection() as conn:
+            conn.execute('DROP TABLE %s' % tbl, commit=True)
+
+def test_upsert_duplicated_keys(db):
+    # the same input counts the same on the ON CONFLICT path and the row-wise one
+    tbls = {'tbl_upsert_pk': 'id INTEGER PRIMARY KEY', 'tbl_upsert_nokey': 'id INTEGER'}
+    with db.get_connection() as conn:
+        for tbl, col in tbls.items():
+            conn.execute('CREATE TABLE %s (%s, txt VARCHAR(45))' % (tbl, col), commit=True)
+    try:
+        recs = [{'id': 1, 'txt': 'a'}, {'id': 1, 'txt': 'b'}, {'id': 2, 'txt': 'c'}, {'id': 2, 'txt': 'd'}]
+        for tbl in tbls:
+            db.insert(tbl, [{'id': 1, 'txt': 'x'}])
+            assert db.upsert(tbl, recs, keyflds=['id']) == (1, 3)
+            assert db.findone(tbl, id=1).txt == 'b' and db.findone(tbl, id=2).txt == 'd'
+    finally:
+        with db.get_connection() as conn:
+            for tbl in tbls:
+                conn.execute('DROP TABLE %s' % tbl, commit=True)
+
 def test_delete(db):
     tbl = TBLS[0]
     recs = [
@@ -131,5 +191,305 @@ def test_select(db):
     assert len(rs) == 1 and rs[0].txt == 'txt1' and not hasattr(rs[0], 'num')
 
 def test_exec_script(db):
-    db.exec_script(SQL_PTH)
-    assert len(db.lists()) == len(TBLS)
\ No newline at end of file
+    assert db.exec_script(SQL_PTH)
+    assert len(db.lists()) == len(TBLS)
+
+def test_exec_script_stream(tmp_path):
+    fp = str(tmp_path / 'dump.sql')
+    with open(fp, 'w', encoding='utf-8') as f:
+        f.write('PRAGMA foreign_keys=OFF;\nBEGIN TRANSACTION;\n')
+        f.write('CREATE TABLE t (id INTEGER PRIMARY KEY, -- id; key\n  txt TEXT);\n')
+        for i in range(250):
+            f.write("INSERT INTO t VALUES(%d, 'a;b''%d'); /* c;%d */\n" % (i, i, i))
+        f.write('COMMIT;\n')
+    stats = []
+    tdb = ZWSqlite('file:{}'.format(tmp_path / 'restore.db'))
+    assert tdb.exec_script(fp, chunk_size=100, progress=stats.append)
+    assert tdb.count('t') == 250 and tdb.findone('t', id=7).txt == "a;b'7"
+    assert [o['statements'] for o in stats] == [100, 200, 252] and stats[-1]['rate'] > 0
+    fp2 = str(tmp_path / 'trigger.sql')
+    with open(fp2, 'w', encoding='utf-8') as f:
+        f.write('CREATE TABLE log (n INTEGER);\nCREATE TRIGGER tg AFTER INSERT ON t BEGIN\n')
+        f.write('  INSERT INTO log VALUES(new.id);\n  DELETE FROM log WHERE n < 0;\nEND;\n')
+        f.write("SAVEPOINT sp;\nINSERT INTO t VALUES(-1, 'x');\nROLLBACK TO sp;\nRELEASE sp;\n")
+        f.write("INSERT INTO t VALUES(500, 'y');\nEND TRANSACTION;\n")
+    assert tdb.exec_script(fp2)
+    assert tdb.count('t', id=-1) == 0 and [r.n for r in tdb.find('log', fetchall=True)] == [500]
+    with open(fp2, 'w', encoding='utf-8') as f:
+        f.write("BEGIN;\nINSERT INTO t VALUES(501, 'z');\nROLLBACK;\n")
+    assert not tdb.exec_script(fp2) and tdb.count('t', id=501) == 0
+    with open(fp, 'a', encoding='utf-8') as f:
+        f.write("INSERT INTO t VALUES(1000, 'x');\nINSERT INTO nope VALUES(1);\n")
+    assert not tdb.exec_script(fp, chunk_size=10000) and tdb.count('t', id=1000) == 0
+    # a script ending on a full chunk reports that chunk once
+    fp3 = str(tmp_path / 'chunks.sql')
+    with open(fp3, 'w', encoding='utf-8') as f:
+        f.write('CREATE TABLE c (n INTEGER);\n' + ''.join('INSERT INTO c VALUES(%d);\n' % i for i in range(199)))
+    stats = []
+    assert tdb.exec_script(fp3, chunk_size=100, progress=stats.append)
+    assert [o['statements'] for o in stats] == [100, 200]
+
+def test_pool(db):
+    tbl = TBLS[0]
+    with ZWSqlite(DB_URL, pool_size=2, pool_timeout=0.1) as pdb:
+        c = pdb.count(tbl)
+        with pdb.get_connection() as conn:
+            raw = conn.conn
+        with pdb.get_connection() as conn:
+            assert conn.conn is raw
+        rs = pdb.find(tbl)
+        assert len(rs.all()) == c and pdb._pool._idle.qsize() == 1
+        for _ in range(3):
+            rs = pdb.find(tbl, arraysize=1)
+            assert rs[0].id
+            del rs
+        assert pdb._pool._idle.qsize() == pdb._pool.size
+        conns = [pdb.get_connection(), pdb.get_connection()]
+        with pytest.raises(ZwdbError):
+            pdb.get_connection()
+        for conn in conns:
+            conn.close()
+        # a waiter takes the slot a discarded connection frees
+        raws = [pdb._pool.get(), pdb._pool.get()]
+        with ThreadPoolExecutor(1) as ex:
+            fut = ex.submit(pdb.count, tbl)
+            pdb._pool._discard(raws.pop())
+            assert fut.result(timeout=1) == c
+        pdb._pool.put(raws.pop())
+    assert pdb._pool.size == 0
+
+def test_profile(tmp_path):
+    url = 'file:{}?profile=read_heavy&cache_size=-1000'.format(tmp_path / 'profile.db')
+    with ZWSqlite(url, synchronous='OFF') as pdb:
+        pragmas = pdb.info['pragmas']
+        assert pdb.info['profile'] == 'read_heavy'
+        assert pragmas['journal_mode'] == 'wal' and pragmas['mmap_size'] == 268435456
+        assert pragmas['cache_size'] == -1000 and pragmas['synchronous'] == 0
+    with pytest.raises(ValueError):
+        ZWSqlite(url, profile='fast')
+
+def test_transaction(db):
+    tbl = TBLS[0]
+    c = db.count(tbl)
+    with db.transaction() as conn:
+        conn.insert(tbl, [{'txt': 'zt1', 'num': 100}])
+        conn.insert(tbl, [{'txt': 'zt2', 'num': 101}])
+    assert db.count(tbl) == c + 2
+    with pytest.raises(ZeroDivisionError):
+        with db.transaction() as conn:
+            conn.delete(tbl, None, None, txt={'like': 'zt%'})
+            _ = 1/0
+    assert db.count(tbl) == c + 2
+    assert db.delete(tbl, txt={'like': 'zt%'}) == 2
+
+def test_group_writer(db):
+    tbl = TBLS[0]
+    c = db.count(tbl)
+    with db.group_writer(interval=0.05) as w:
+        def work(i):
+            return [w.insert(tbl, [{'txt': 'gw%d' % i, 'num': 200 + j}]) for j in range(10)]
+        with ThreadPoolExecutor(4) as ex:
+            futs = [f for fs in ex.map(work, range(4)) for f in fs]
+        bad = w.insert('no_such_tbl', [{'txt': 'gw'}])
+        w.flush()
+        assert all(f.result() == 1 for f in futs)
+        with pytest.raises(Exception):
+            bad.result()
+    assert db.count(tbl) == c + 40 and w.commits < w.operations
+    assert db.delete(tbl, txt={'like': 'gw%'}) == 40
+
+    # a writer which cannot connect fails what was queued instead of leaving it pending
+    wdb, ready = ZWSqlite(DB_URL), threading.Event()
+    def broken():
+        ready.wait(5)
+        raise ZwdbError('cannot connect')
+    wdb.get_connection = broken
+    w = wdb.group_writer()
+    futs = [w.insert(tbl, [{'txt': 'gw'}]) for _ in range(3)]
+    ready.set()
+    for f in futs:
+        with pytest.raises(ZwdbError):
+            f.result(5)
+    with pytest.raises(ZwdbError):
+        w.insert(tbl, [{'txt': 'gw'}])
+    w.close()
+    wdb.close()
+
+def test_group_writer_close_race(db):
+    # close() runs while a submit is between its checks and queueing its write
+    tbl = TBLS[0]
+    w = db.group_writer()
+    thread, closer = w._thread, threading.Thread(target=w.close)
+    class Racing(object):
+        def is_alive(self):
+            closer.start()
+            closer.join(0.2)
+            return thread.is_alive()
+        def join(self):
+            thread.join()
+    w._thread = Racing()
+    f = w.insert(tbl, [{'txt': 'gwr', 'num': 300}])
+    closer.join()
+    w._thread = thread
+    assert f.result(2) == 1
+    with pytest.raises(ZwdbError):
+        w.insert(tbl, [{'txt': 'gwr'}])
+    assert db.delete(tbl, txt='gwr') == 1
+
+def test_iter_pages(db):
+    tbl = 'tbl_pages'
+    with db.get_connection() as conn:
+        conn.execute('CREATE TABLE %s (grp INTEGER, id INTEGER, txt VARCHAR(45), PRIMARY KEY(grp, id))' % tbl, commit=True)
+    try:
+        db.insert(tbl, [{'grp': g, 'id': i, 'txt': 'p%d' % i} for g in range(3) for i in range(7)])
+        pages = list(db.iter_pages(tbl, keyflds=['grp', 'id'], page_size=5))
+        keys = [(r.grp, r.id) for page, _ in pages for r in page]
+        assert len(pages) == 5 and keys == sorted(keys) and len(set(keys)) == 21
+
+        resumed = list(db.iter_pages(tbl, keyflds=['grp', 'id'], page_size=5, cursor=pages[1][1]))
+        assert [(r.grp, r.id) for page, _ in resumed for r in page] == keys[10:]
+
+        ids = [r.id for page, _ in db.iter_pages(tbl, 'id', page_size=4, grp=1) for r in page]
+        assert ids == list(range(7))
+
+        # a NULL key would end paging silently
+        with db.get_connection() as conn:
+            conn.execute('UPDATE %s SET txt=NULL WHERE grp=0 AND id=0' % tbl, commit=True)
+        with pytest.raises(ZwdbError):
+            list(db.iter_pages(tbl, keyflds=['txt', 'id'], page_size=1))
+    finally:
+        with db.get_connection() as conn:
+            conn.execute('DROP TABLE %s' % tbl, commit=True)
+
+def test_update_bulk(db):
+    tbl = 'tbl_update'
+    with db.get_connection() as conn:
+        conn.execute('CREATE TABLE %s (id INTEGER PRIMARY KEY, txt VARCHAR(45), num FLOAT)' % tbl, commit=True)
+    try:
+        db.insert(tbl, [{'id': i, 'txt': 't%d' % i, 'num': i} for i in range(3000)])
+        recs = [{'id': i, 'txt': 'u%d' % i, 'num': -i} for i in range(0, 4000, 2)]
+        recs.append({'id': 0, 'txt': 'last', 'num': 0})
+        with db.get_connection() as conn:
+            assert conn.bulk_update_size <= len(recs)
+        assert db.update(tbl, recs, keyflds=['id']) == 1500
+        assert db.findone(tbl, id=0).txt == 'last' and db.findone(tbl, id=2998).num == -2998
+        assert db.findone(tbl, id=1).txt == 't1' and db.count(tbl, txt={'like': 'u%'}) == 1499
+
+        # duplicate keys count once on both paths
+        recs = [{'id': 1, 'txt': 'a', 'num': 1}, {'id': 3, 'txt': 'b', 'num': 3}, {'id': 1, 'txt': 'c', 'num': 1}]
+        assert db.update(tbl, recs, keyflds=['id']) == 2
+        with ZWSqlite(DB_URL, bulk_update_size=2) as bdb:
+            assert bdb.update(tbl, recs, keyflds=['id']) == 2 and bdb.findone(tbl, id=1).txt == 'c'
+    finally:
+        with db.get_connection() as conn:
+            conn.execute('DROP TABLE %s' % tbl, commit=True)
+
+def test_old_sqlite_fallbacks(db, monkeypatch):
+    # sqlite before 3.15 has no row values, before 3.33 no UPDATE ... FROM
+    monkeypatch.setattr(zwsqlite, 'SQLITE_ROW_VALUES', False)
+    monkeypatch.setattr(zwsqlite, 'SQLITE_UPDATE_FROM', False)
+    tbl = 'tbl_fallback'
+    with db.get_connection() as conn:
+        conn.execute('CREATE TABLE %s (txt VARCHAR(45), num INTEGER, val FLOAT)' % tbl, commit=True)
+    try:
+        db.insert(tbl, [{'txt': 't%d' % (i % 2), 'num': i, 'val': i} for i in range(1200)])
+        recs = [{'txt': 't%d' % (i % 2), 'num': i, 'val': -i} for i in range(1100)]
+        assert db.update(tbl, recs, keyflds=['txt', 'num']) == 1100 and db.count(tbl, val={'<': 0}) == 1099
+        recs = [{'txt': 't%d' % (i % 2), 'num': i} for i in range(0, 1000, 2)] + [{'txt': 't1', 'num': 0}]
+        assert db.delete(tbl, recs, keyflds=['txt', 'num']) == 500 and db.count(tbl) == 700
+    finally:
+        with db.get_connection() as conn:
+            conn.execute('DROP TABLE %s' % tbl, commit=True)
+
+def test_exists_many(db):
+    tbl = TBLS[0]
+    recs = [{'id': 1}, {'id': 9999}, {'id': 2}, {'id': 1}]
+    assert db.exists_many(tbl, recs, keyflds=['id']) == [True, False, True, True]
+    rec = db.findone(tbl, id=2)
+    recs = [{'id': 2, 'txt': rec.txt}, {'id': 2, 'txt': 'nope'}] + [{'id': -i, 'txt': 'x'} for i in range(1200)]
+    r = db.exists_many(tbl, recs, keyflds=['id', 'txt'])
+    assert r[:2] == [True, False] and not any(r[2:]) and len(r) == len(recs)
+    assert db.exists_many(tbl, [], keyflds=['id']) == []
+    # the server decides equality, a text id matches the integer key as in exists
+    assert db.exists(tbl, {'id': '2'}, ['id']) and db.exists_many(tbl, [{'id': '2'}], keyflds=['id']) == [True]
+
+def test_delete_bulk(db):
+    tbl = 'tbl_delete'
+    with db.get_connection() as conn:
+        conn.execute('CREATE TABLE %s (id INTEGER PRIMARY KEY, txt VARCHAR(45), num INTEGER)' % tbl, commit=True)
+    try:
+        db.insert(tbl, [{'id': i, 'txt': 't%d' % (i % 3), 'num': i % 7} for i in range(3000)])
+        recs = [{'id': i} for i in range(0, 4000, 2)] + [{'id': 0}]
+        assert db.delete(tbl, recs, keyflds=['id']) == 1500 and db.count(tbl) == 1500
+        recs = [{'txt': 't1', 'num': n} for n in range(7)]
+        c = db.count(tbl, txt='t1')
+        assert db.delete(tbl, recs, keyflds=['txt', 'num'], chunk_size=2, throttle=0.001) == c
+        assert db.count(tbl, txt='t1') == 0 and db.count(tbl) == 1500 - c
+
+        # no pause while a transaction holds the write lock
+        recs = [{'id': i} for i in range(1, 3000, 2)]
+        c, t = db.count(tbl), time.monotonic()
+        with db.transaction() as conn:
+            rc = conn.delete(tbl, recs, keyflds=['id'], chunk_size=100, throttle=1)
+        assert time.monotonic() - t < 1 and rc == c - db.count(tbl) > 0
+    finally:
+        with db.get_connection() as conn:
+            conn.execute('DROP TABLE %s' % tbl, commit=True)
+
+def test_insert_iter(db):
+    tbl = 'tbl_insert'
+    with db.get_connection() as conn:
+        conn.execute('CREATE TABLE %s (id INTEGER PRIMARY KEY, txt VARCHAR(45))' % tbl, commit=True)
+    try:
+        recs = ({'id': i, 'txt': 't%d' % i} for i in range(2500))
+        assert db.insert(tbl, recs, chunk_size=1000) == 2500 and db.count(tbl) == 2500
+        assert db.insert(tbl, iter([])) == 0 and db.insert(tbl, None) == 0
+    finally:
+        with db.get_connection() as conn:
+            conn.execute('DROP TABLE %s' % tbl, commit=True)
+
+def test_insert_columns(db):
+    from array import array
+    tbl = 'tbl_columns'
+    with db.get_connection() as conn:
+        conn.execute('CREATE TABLE %s (id INTEGER PRIMARY KEY, txt VARCHAR(45), num FLOAT)' % tbl, commit=True)
+    try:
+        cols = {'id': range(2500), 'txt': ['t%d' % i for i in range(2500)], 'num': array('d', [i * 0.5 for i in range(2500)])}
+        assert db.insert_columns(tbl, cols, chunk_size=1000) == 2500
+        r = db.findone(tbl, id=7)
+        assert db.count(tbl) == 2500 and r.txt == 't7' and r.num == 3.5
+        with pytest.raises(ValueError):
+            db.insert_columns(tbl, {'id': [1, 2], 'txt': ['a']})
+        np = pytest.importorskip('numpy')
+        cols = {'id': np.arange(2500, 2600), 'num': np.linspace(0, 1, 100)}
+        assert db.insert_columns(tbl, cols) == 100 and db.findone(tbl, id=2599).num == 1.0
+    finally:
+        with db.get_connection() as conn:
+            conn.execute('DROP TABLE %s' % tbl, commit=True)
+
+def test_parallel_find(db):
+    tbl = 'tbl_scan'
+    with db.get_connection() as conn:
+        conn.execute('CREATE TABLE %s (id INTEGER PRIMARY KEY, k INTEGER, txt VARCHAR(45))' % tbl, commit=True)
+    try:
+        db.insert(tbl, [{'id': i, 'k': None if i % 100 == 0 else i, 'txt': 't%05d' % i} for i in range(3000)])
+        ids = sorted(r.id for r in db.parallel_find(tbl, partitions=4))
+        assert ids == list(range(3000))
+        with db.get_connection() as conn:
+            assert conn.split_points(tbl, 'id', 4) == [750, 1500, 2250]
+        ids = sorted(r.id for r in db.parallel_find(tbl, split_key='k', partitions=3, arraysize=100))
+        assert ids == list(range(3000))
+        ids = sorted(r.id for r in db.parallel_find(tbl, split_key='txt', partitions=3, txt={'<': 't01000'}))
+        assert ids == list(range(1000))
+        scans = db.parallel_find(tbl, partitions=3, merge=False)
+        with ThreadPoolExecutor(3) as ex:
+            counts = list(ex.map(lambda it: sum(1 for _ in it), scans))
+        assert counts == [1000, 1000, 1000]
+        it = db.parallel_find(tbl, partitions=4, arraysize=10)
+        assert next(it).txt.startswith('t')
+        it.close()
+        with pytest.raises(ZwdbError):
+            ZWSqlite(':memory:').parallel_find(tbl)
+    finally:
+        with db.get_connection() as conn:
+            conn.execute('DROP TABLE %s' % tbl, commit=True)
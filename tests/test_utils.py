@@ -17,4 +17,52 @@ from zwdb import utils
 )
 def test_db_url_parser(db_url, result):
     rtn = utils.db_url_parser(db_url)
-    assert (rtn is not None) == result
\ No newline at end of file
+    assert (rtn is not None) == result
+
+def test_cursor_token():
+    import datetime
+    from decimal import Decimal
+    vals = [1, 'a b', datetime.datetime(2020, 1, 2, 3, 4, 5), datetime.date(2020, 1, 2), Decimal('1.50'), b'\x00\xff', None]
+    token = utils.encode_cursor(vals)
+    assert utils.decode_cursor(token) == vals and '/' not in token
+    tz = datetime.timezone(datetime.timedelta(hours=-5, minutes=-30))
+    vals = [datetime.datetime(2020, 1, 2, 3, 4, 5, 6, tzinfo=tz), datetime.datetime(2020, 1, 2, 3, 4, 5, 6)]
+    dec = utils.decode_cursor(utils.encode_cursor(vals))
+    assert dec == vals and dec[0].utcoffset() == tz.utcoffset(None) and dec[1].tzinfo is None
+
+def test_split_sql():
+    script = r"""-- head; comment
+CREATE TABLE t (a TEXT); -- tail ; comment
+INSERT INTO t VALUES('x;y', 'it''s', "q;"),
+  ('a\';b');
+/* drop ; me */ /*!40101 SET @x=1 */;
+# hash ; comment
+SELECT 2"""
+    lines = script.splitlines(True)
+    assert list(utils.split_sql(lines, 'mysql')) == [
+        'CREATE TABLE t (a TEXT)',
+        'INSERT INTO t VALUES(\'x;y\', \'it\'\'s\', "q;"),\n  (\'a\\\';b\')',
+        '/*!40101 SET @x=1 */',
+        'SELECT 2',
+    ]
+    # no backslash escapes in sqlite
+    assert list(utils.split_sql(lines))[2].startswith("b')")
+    # sqlite trigger bodies stay whole
+    trigger = 'CREATE TRIGGER tg AFTER INSERT ON t BEGIN\n  UPDATE t SET a=1;\n  DELETE FROM t;\nEND'
+    assert list(utils.split_sql((trigger + ';\nSELECT 1;').splitlines(True))) == [trigger, 'SELECT 1']
+    # mysqldump writes trigger bodies between DELIMITER lines
+    body = "/*!50003 CREATE*/ /*!50003 TRIGGER tg AFTER INSERT ON t FOR EACH ROW BEGIN\nSET @a=';';\nSET @b=2;\nEND */"
+    dump = 'SELECT 1;\nDELIMITER ;;\n' + body + ';;\nDELIMITER ;\nSELECT 2;\n'
+    assert list(utils.split_sql(dump.splitlines(True), 'mysql')) == ['SELECT 1', body, 'SELECT 2']
+    assert list(utils.split_sql(dump.splitlines(True), 'mysql', delimiters=True)) == [
+        ('SELECT 1', ';'), (body, ';;'), ('SELECT 2', ';')]
+
+def test_merge_parallel():
+    assert utils.split_points(0, 99, 4) == [25, 50, 75] and utils.split_points(5, 6, 4) == [6]
+    items = sorted(utils.merge_parallel([range(0, 500), iter(range(500, 700)), []], batch_size=64))
+    assert items == list(range(700))
+    def boom():
+        yield 1
+        raise RuntimeError('boom')
+    with pytest.raises(RuntimeError):
+        list(utils.merge_parallel([boom(), range(10000)], batch_size=1))
@@ -1,14 +1,50 @@
+from array import array
+from itertools import islice
+
+def _index_keys(keys):
+    """Map column names to their positions, duplicated names map to None."""
+    index = {}
+    for i, k in enumerate(keys):
+        index[k] = None if k in index else i
+    return index
+
+def _stream_getitem(coll, key):
+    """Index a stream mode collection, only rows ahead of the cursor are reachable."""
+    is_int = isinstance(key, int)
+    start = key if is_int else key.start or 0
+    stop = key + 1 if is_int else key.stop
+    if start < 0 or (stop is not None and stop < 0) or (not is_int and key.step not in (None, 1)):
+        raise ZwdbError('{} in stream mode does not support negative index or step.'.format(type(coll).__name__))
+    if start < coll._consumed:
+        raise ZwdbError('{} in stream mode, row {} has already been consumed.'.format(type(coll).__name__, start))
+
+    rows = []
+    while stop is None or coll._consumed < stop:
+        try:
+            row = next(coll)
+        except StopIteration:
+            break
+        if coll._consumed > start:
+            rows.append(row)
+    if is_int:
+        if not rows:
+            raise IndexError('{} index out of range.'.format(type(coll).__name__))
+        return rows[0]
+    return rows
+
 class Record(object):
     """A row, from a query, from a database."""
-    __slots__ = ('_keys', '_values')
+    __slots__ = ('_keys', '_values', '_index')
 
-    def __init__(self, keys=None, values=None, o=None):
+    def __init__(self, keys=None, values=None, o=None, index=None):
         if isinstance(o, dict):
             self._keys = list(o.keys())
             self._values = list(o.values())
         else:
             self._keys = keys
             self._values = values
+        # column name -> position, shared by all records of a RecordCollection
+        self._index = index
 
         # Ensure that lengths match properly.
         if not isinstance(o, dict):
@@ -30,14 +66,16 @@ class Record(object):
         if isinstance(key, int):
             return self.values()[key]
 
-        # Support for string-based lookup.
-        if key in self.keys():
-            i = self.keys().index(key)
-            if self.keys().count(key) > 1:
-                raise KeyError("Record contains multiple '{}' fields.".format(key))
-            return self.values()[i]
-
-        raise KeyError("Record contains no '{}' field.".format(key))
+        # Support for string-based lookup, index is built on first use.
+        if self._index is None:
+            self._index = _index_keys(self._keys)
+        try:
+            i = self._index[key]
+        except (KeyError, TypeError):
+            raise KeyError("Record contains no '{}' field.".format(key)) from None
+        if i is None:
+            raise KeyError("Record contains multiple '{}' fields.".format(key))
+        return self._values[i]
 
     def __getattr__(self, key):
          # Support for attr-based lookup.
@@ -64,16 +102,30 @@ class Record(object):
         return dict(items)
 
 class RecordCollection(object):
-    """A set of Records from a query."""
-    def __init__(self, keys, rows):
+    """A set of Records from a query.
+
+    In stream mode rows are handed out once and never cached, so memory stays
+    flat however many rows the cursor yields.
+    """
+    def __init__(self, keys, rows, stream=False):
         self._keys = keys
+        self._index = _index_keys(keys) if keys else None
         self._rows = rows
         self._all_rows = []
+        self._consumed = 0
+        self.stream = stream
         self.pending = True
+        # rows went from the cursor to to_columns without being cached
+        self.columnar = False
+
+    def _check_columnar(self):
+        if self.columnar:
+            raise ZwdbError('RecordCollection rows were read by to_columns and are not cached.')
 
     def all(self, as_dict=False):
         """Returns a list of all rows for the RecordCollection. If they haven't
-        been fetched yet, consume the iterator and cache the results."""
+        been fetched yet, consume the iterator and cache the results.
+        In stream mode only the rows not consumed yet are returned."""
 
         # By calling list it calls the __iter__ method
         rows = list(self)        
@@ -84,8 +136,65 @@ class RecordCollection(object):
     def as_dict(self):
         return self.all(as_dict=True)
 
+    def _raw_batches(self, batch_size):
+        """Yield lists of row values, cached rows first, then straight from the cursor."""
+        self._check_columnar()
+        if not self.stream and self._all_rows:
+            yield [r.values() for r in self._all_rows]
+        fetchmany = getattr(self._rows, 'fetchmany', None)
+        while self.pending:
+            rows = fetchmany(batch_size) if fetchmany else list(islice(self._rows, batch_size))
+            if not rows:
+                self.pending = False
+                break
+            self._consumed += len(rows)
+            self.columnar = not self.stream
+            yield rows
+
+    def to_columns(self, typecodes=None, batch_size=1000):
+        """Returns a dict of column name to list of values, or to :py:class:`array.array`
+        for columns given a typecode. Rows are pulled from the cursor in batches and
+        never wrapped in Records. Rows fetched here are not cached, once it has read from
+        the cursor any later access to a non stream collection raises ZwdbError.
+
+        :param dict typecodes: column name to array typecode such as 'q' or 'd', columns must not hold NULL
+        :param int batch_size: rows pulled per fetch
+        """
+        typecodes = typecodes or {}
+        keys = self._keys or []
+        cols = [array(typecodes[k]) if k in typecodes else [] for k in keys]
+        for rows in self._raw_batches(batch_size):
+            for col, vals in zip(cols, zip(*rows)):
+                col.extend(vals)
+        return dict(zip(keys, cols))
+
+    def to_numpy(self, dtypes=None, structured=False, batch_size=1000):
+        """Returns a dict of column name to ndarray, or one structured array. Requires numpy.
+
+        :param dict dtypes: column name to numpy dtype, inferred by numpy if absent
+        :param bool structured: return a structured record array instead of a dict
+        :param int batch_size: rows pulled per fetch
+        """
+        try:
+            import numpy as np
+        except ImportError as e:
+            raise ZwdbError('to_numpy requires numpy to be installed.') from e
+        dtypes = dtypes or {}
+        cols = self.to_columns(batch_size=batch_size)
+        arrs = {k: np.asarray(v, dtype=dtypes.get(k)) for k, v in cols.items()}
+        if structured:
+            return np.rec.fromarrays(list(arrs.values()), names=list(arrs.keys()))
+        return arrs
+
     def __iter__(self):
         """Iterate over all rows, consuming the underlying generator only when necessary."""
+        self._check_columnar()
+        if self.stream:
+            while True:
+                try:
+                    yield next(self)
+                except StopIteration:
+                    return
         i = 0
         while True:
             # Other code may have iterated between yields,
@@ -102,23 +211,30 @@ class RecordCollection(object):
             i += 1
 
     def __next__(self):
+        self._check_columnar()
         try:
             nextrow = next(self._rows)
-            nextrec = Record(self._keys, nextrow)
-            self._all_rows.append(nextrec)
+            nextrec = Record(self._keys, nextrow, index=self._index)
+            self._consumed += 1
+            if not self.stream:
+                self._all_rows.append(nextrec)
             return nextrec
         except StopIteration:
             self.pending = False
             raise StopIteration('RecordCollection contains no more rows.')
 
     def __getitem__(self, key):
+        if self.stream:
+            rows = _stream_getitem(self, key)
+            return rows if isinstance(key, int) else RecordCollection(self._keys, (r.values() for r in rows))
+        self._check_columnar()
         is_int = isinstance(key, int)
 
         # Convert RecordCollection[1] into slice.
         if is_int:
             key = slice(key, key + 1)
 
-        while len(self) < key.stop or key.stop is None:
+        while key.stop is None or len(self) < key.stop:
             try:
                 next(self)
             except StopIteration:
@@ -128,24 +244,28 @@ class RecordCollection(object):
         if is_int:
             return rows[0]
         else:
-            return RecordCollection(self._keys, iter(rows))
+            return RecordCollection(self._keys, (r.values() for r in rows))
 
     def __len__(self):
-        return len(self._all_rows)
+        self._check_columnar()
+        return self._consumed if self.stream else len(self._all_rows)
 
     def __repr__(self):
-        return '<RecordCollection size={} pending={}>'.format(len(self), self.pending)
+        return '<RecordCollection size={} pending={} stream={}>'.format(self._consumed, self.pending, self.stream)
 
 class DocumentCollection(object):
-    """A set of Records from a query."""
-    def __init__(self, docs):
+    """A set of Records from a query, see :py:class:`RecordCollection` for stream mode."""
+    def __init__(self, docs, stream=False):
         self._docs = docs
         self._all_docs = []
+        self._consumed = 0
+        self.stream = stream
         self.pending = True
 
     def all(self):
         """Returns a list of all rows for the DocumentCollection. If they haven't
-        been fetched yet, consume the iterator and cache the results."""
+        been fetched yet, consume the iterator and cache the results.
+        In stream mode only the docs not consumed yet are returned."""
 
         # By calling list it calls the __iter__ method
         docs = list(self)
@@ -153,6 +273,12 @@ class DocumentCollection(object):
 
     def __iter__(self):
         """Iterate over all rows, consuming the underlying generator only when necessary."""
+        if self.stream:
+            while True:
+                try:
+                    yield next(self)
+                except StopIteration:
+                    return
         i = 0
         while True:
             # Other code may have iterated between yields,
@@ -172,20 +298,25 @@ class DocumentCollection(object):
         try:
             nextdoc = next(self._docs)
             nextrec = Record(o=nextdoc)
-            self._all_docs.append(nextrec)
+            self._consumed += 1
+            if not self.stream:
+                self._all_docs.append(nextrec)
             return nextrec
         except StopIteration:
             self.pending = False
             raise StopIteration('DocumentCollection contains no more docs.')
 
     def __getitem__(self, key):
+        if self.stream:
+            rows = _stream_getitem(self, key)
+            return rows if isinstance(key, int) else DocumentCollection(r.as_dict() for r in rows)
         is_int = isinstance(key, int)
 
         # Convert RecordCollection[1] into slice.
         if is_int:
             key = slice(key, key + 1)
 
-        while len(self) < key.stop or key.stop is None:
+        while key.stop is None or len(self) < key.stop:
             try:
                 next(self)
             except StopIteration:
@@ -195,13 +326,13 @@ class DocumentCollection(object):
         if is_int:
             return rows[0]
         else:
-            return DocumentCollection(iter(rows))
+            return DocumentCollection(r.as_dict() for r in rows)
 
     def __len__(self):
-        return len(self._all_docs)
+        return self._consumed if self.stream else len(self._all_docs)
 
     def __repr__(self):
-        return '<DocumentCollection size={} pending={}>'.format(len(self), self.pending)
+        return '<DocumentCollection size={} pending={} stream={}>'.format(len(self), self.pending, self.stream)
 
 class ZwdbError(Exception):
     def __init__(self, reason):
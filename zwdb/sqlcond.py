@@ -0,0 +1,128 @@
+'''Compile the where condition kwargs of the SQL drivers into placeholder only sql
+
+    num=1                       num=:num
+    none=None                   none IS NULL
+    txt={'like': 'a%'}          txt LIKE :_w0
+    num={'or': (2, 3)}          (num=:_w0 OR num=:_w1)
+    num={'range': (1, 3)}       (num>=:_w0 AND num<:_w1)
+
+Values are always bound, so the sql text only depends on the shape of the
+condition (fields, operators, length of or lists). Templates are memoized
+by shape, repeated queries skip string building and hit the statement cache
+of sqlite3 or the server.
+'''
+from functools import lru_cache
+
+PLACEHOLDERS = {
+    'named'     : ':{}',        # sqlite3
+    'pyformat'  : '%({})s',     # mysql.connector
+}
+NULL_TESTS = {
+    'named'     : '{} IS NULL',
+    'pyformat'  : 'ISNULL({})',
+}
+OPERATORS = {
+    'like'  : 'LIKE',
+    '<>'    : '<>',
+    '>'     : '>',
+    '>='    : '>=',
+    '<'     : '<',
+    '<='    : '<=',
+}
+CACHE_SIZE = 1024
+
+def _shape(fld, val):
+    if val is None:
+        return (fld, None)
+    if not isinstance(val, dict):
+        return (fld, '=')
+    op, v = list(val.items())[0]
+    op = op if op is None else op.lower()
+    if op is None:
+        return (fld, None)
+    if op == 'or':
+        return (fld, op, len(v))
+    if op == 'range' or op in OPERATORS:
+        return (fld, op)
+    # unknown operator, the value is a raw sql fragment such as 'IS NOT NULL'
+    return (fld, 'raw', v)
+
+def _values(val):
+    if val is None:
+        return ()
+    if not isinstance(val, dict):
+        return (val,)
+    op, v = list(val.items())[0]
+    op = op if op is None else op.lower()
+    if op == 'or':
+        return tuple(v)
+    if op == 'range':
+        return (v[0], v[1])
+    if op in OPERATORS:
+        return (v,)
+    return ()
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _compile(shape, paramstyle):
+    '''Return (sql, names) for a condition shape, names are the bound parameters in value order'''
+    ph = PLACEHOLDERS[paramstyle]
+    names = []
+    binds = []
+    def bind():
+        name = '_w{}'.format(len(binds))
+        binds.append(name)
+        names.append(name)
+        return ph.format(name)
+    ws = []
+    for item in shape:
+        fld, op = item[0], item[1]
+        if op == '=':
+            names.append(fld)
+            s = '{}={}'.format(fld, ph.format(fld))
+        elif op is None:
+            s = '({})'.format(NULL_TESTS[paramstyle].format(fld))
+        elif op == 'or':
+            s = '({})'.format(' OR '.join(['{}={}'.format(fld, bind()) for _ in range(item[2])]))
+        elif op == 'range':
+            s = '({0}>={1} AND {0}<{2})'.format(fld, bind(), bind())
+        elif op == 'raw':
+            s = '({} {})'.format(fld, item[2])
+        else:
+            s = '({} {} {})'.format(fld, OPERATORS[op], bind())
+        ws.append(s)
+    ws.append('1=1')
+    return ' AND '.join(ws), tuple(names)
+
+def compile_wheres(params, paramstyle):
+    '''Compile where condition kwargs into (sql, args)
+
+    :param dict params: field to value or {operator: value}
+    :param str paramstyle: 'named' or 'pyformat'
+    :return: sql template and dict of bound values
+    :rtype: tuple
+    '''
+    shape = tuple(_shape(k, v) for k, v in params.items())
+    sql, names = _compile(shape, paramstyle)
+    vals = [o for v in params.values() for o in _values(v)]
+    return sql, dict(zip(names, vals))
+
+def compile_keyflds(keyflds, paramstyle):
+    '''Compile key fields locating records into (sql, args). Plain field names bind to the
+    record's own value, dict items are conditions whose values are shared by all records.
+    Items keep their order and a field may appear both plain and in a condition.
+    '''
+    shape = []
+    binds = []      # (value, shared) per bound parameter
+    for k in keyflds:
+        if isinstance(k, str):
+            shape.append((k, '='))
+            binds.append((None, False))
+        else:
+            for fld, val in k.items():
+                shape.append(_shape(fld, val))
+                binds.extend((v, True) for v in _values(val))
+    sql, names = _compile(tuple(shape), paramstyle)
+    return sql, {n: v for n, (v, shared) in zip(names, binds) if shared}
+
+cache_info = _compile.cache_info
+cache_clear = _compile.cache_clear
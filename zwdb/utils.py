@@ -1,4 +1,14 @@
+import re
+import sqlite3
+import json
+import queue
+import threading
+import base64
+from decimal import Decimal
+from datetime import date, datetime
 from inspect import isclass
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from urllib.parse import urlparse, parse_qs
 
 def extend_attrs(settings, setting_items):
@@ -40,3 +50,261 @@ def db_url_parser(db_url):
         'db': db.strip(),
         'props': props
     }
+
+# fixed formats strptime reads back, fromisoformat is 3.7+
+CURSOR_DT_FMT = '%Y-%m-%dT%H:%M:%S.%f'
+CURSOR_D_FMT = '%Y-%m-%d'
+
+def _cursor_enc(v):
+    if isinstance(v, datetime):
+        return {'$dt': v.strftime(CURSOR_DT_FMT + ('%z' if v.utcoffset() is not None else ''))}
+    if isinstance(v, date):
+        return {'$d': v.strftime(CURSOR_D_FMT)}
+    if isinstance(v, Decimal):
+        return {'$dec': str(v)}
+    if isinstance(v, bytes):
+        return {'$b': base64.b64encode(v).decode('ascii')}
+    return v
+
+def _cursor_dt(s):
+    # an aware datetime ends with the +HHMM offset written by %z
+    fmt = CURSOR_DT_FMT + '%z' if s[-5:-4] in ('+', '-') else CURSOR_DT_FMT
+    return datetime.strptime(s, fmt)
+
+def _cursor_dec(v):
+    if isinstance(v, dict):
+        k, v = list(v.items())[0]
+        return {
+            '$dt': _cursor_dt,
+            '$d': lambda s: datetime.strptime(s, CURSOR_D_FMT).date(),
+            '$dec': Decimal,
+            '$b': base64.b64decode,
+        }[k](v)
+    return v
+
+def encode_cursor(values):
+    """Encode the key values of a page's last row into an opaque url safe token."""
+    s = json.dumps([_cursor_enc(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(s.encode('utf-8')).decode('ascii')
+
+def decode_cursor(token):
+    """Decode a token from :py:func:`encode_cursor` back into key values."""
+    s = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8')
+    return [_cursor_dec(v) for v in json.loads(s)]
+
+def keyset_pages(connect, tbl, keyflds, page_size, cursor, params):
+    """Yield (page, cursor) of keyset pagination, each page read on a connection from connect()."""
+    keyflds = [keyflds] if isinstance(keyflds, str) else list(keyflds)
+    last = decode_cursor(cursor) if cursor else None
+    while True:
+        with connect() as conn:
+            page = conn.find_page(tbl, keyflds, page_size, last, **params)
+        if len(page) == 0:
+            return
+        last = [page.all()[-1][k] for k in keyflds]
+        yield page, encode_cursor(last)
+        if len(page) < page_size:
+            return
+
+# records per batch when an insert consumes an iterator
+CHUNK_SIZE = 10000
+
+def chunked(items, size=None):
+    """Yield lists of at most size items from any iterable, so only one chunk is in
+    memory at a time. Without size, lists and tuples are yielded whole and other
+    iterables in chunks of :py:data:`CHUNK_SIZE`.
+    """
+    if items is None:
+        return
+    if size is None and isinstance(items, (list, tuple)):
+        if items:
+            yield items
+        return
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size or CHUNK_SIZE))
+        if not chunk:
+            return
+        yield chunk
+
+def iter_column(seq, size=CHUNK_SIZE):
+    """Iterate a column sequence as plain python values. Sequences with ``tolist``
+    such as numpy arrays are converted a slice at a time, drivers can not bind numpy scalars.
+    """
+    if not hasattr(seq, 'tolist'):
+        yield from seq
+        return
+    for i in range(0, len(seq), size):
+        yield from seq[i:i+size].tolist()
+
+def zip_columns(columns):
+    """Lazily zip a dict of column name to sequence into row tuples, return (names, rows)."""
+    lens = {len(v) for v in columns.values() if hasattr(v, '__len__')}
+    if len(lens) > 1:
+        raise ValueError('Columns differ in length: {}.'.format(sorted(lens)))
+    return list(columns.keys()), zip(*[iter_column(v) for v in columns.values()])
+
+def split_points(lo, hi, partitions):
+    """Cut points splitting the integer key range [lo, hi] into at most partitions ranges of equal width."""
+    n = max(1, partitions)
+    return sorted({lo + (hi - lo + 1) * i // n for i in range(1, n)} - {lo})
+
+class _Failure(object):
+    __slots__ = ('error',)
+    def __init__(self, error):
+        self.error = error
+
+def merge_parallel(iterables, batch_size=1000):
+    """Consume each iterable on its own thread and yield their items as they arrive,
+    order across iterables is not kept. Each iterable is started, read and closed on
+    one worker thread, so it may own a thread bound connection. An error in any
+    iterable is raised to the consumer, and closing the merged generator stops the workers.
+    """
+    iterables = list(iterables)
+    if not iterables:
+        return
+    q = queue.Queue(maxsize=2 * len(iterables))
+    stop = threading.Event()
+    done = object()
+
+    def put(o):
+        while not stop.is_set():
+            try:
+                q.put(o, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def drain(it):
+        try:
+            batch = []
+            for item in it:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch:
+                put(batch)
+        except Exception as ex:
+            put(_Failure(ex))
+        finally:
+            close = getattr(it, 'close', None)
+            if close:
+                close()
+            put(done)
+
+    with ThreadPoolExecutor(max_workers=len(iterables)) as executor:
+        for it in iterables:
+            executor.submit(drain, it)
+        try:
+            left = len(iterables)
+            while left:
+                o = q.get()
+                if o is done:
+                    left -= 1
+                elif isinstance(o, _Failure):
+                    raise o.error
+                else:
+                    yield from o
+        finally:
+            stop.set()
+
+RE_SQL_TOKEN = re.compile(r"""[;'"`#]|--|/\*""")
+# mysql client command, statements end at the given delimiter until the next one
+RE_SQL_DELIMITER = re.compile(r'\s*DELIMITER\s+(\S+)', re.I)
+RE_SQL_QUOTE = {
+    (q, esc): re.compile(r'\\|' + q if esc else q) for q in ('\'', '"', '`') for esc in (True, False)
+}
+
+def split_sql(lines, dialect='sqlite', delimiters=False):
+    """Yield the statements of a sql script, without the trailing delimiter. Lines
+    are consumed lazily, so only the statement being read is kept in memory.
+
+    Semicolons in quotes and comments do not end a statement. Comments are
+    dropped except ``/*! ... */`` and ``/*+ ... */`` blocks, which mysql runs.
+    The sqlite dialect keeps trigger bodies whole, a statement ends at the first
+    ';' sqlite3.complete_statement accepts. The mysql dialect also knows
+    backslash escapes, ``#`` comments and the client's ``DELIMITER`` lines, as
+    mysqldump writes around trigger and routine bodies.
+
+    :param iterable(str) lines: script lines such as an open file
+    :param str dialect: 'sqlite' or 'mysql'
+    :param bool delimiters: yield (statement, delimiter) pairs, the delimiter in effect
+        when the statement ended, so a body read between DELIMITER lines can be told apart
+    """
+    mysql = dialect == 'mysql'
+    buf = []
+    state = None    # quote char, or '*/' in a dropped comment, '*!' in a kept one
+    delim, token = ';', RE_SQL_TOKEN
+    for line in lines:
+        if mysql and state is None:
+            m = RE_SQL_DELIMITER.match(line)
+            if m and not ''.join(buf).strip():
+                delim = m.group(1)
+                token = RE_SQL_TOKEN if delim == ';' else re.compile(re.escape(delim) + r"""|['"`#]|--|/\*""")
+                continue
+        pos, n = 0, len(line)
+        while pos < n:
+            if state is None:
+                m = token.search(line, pos)
+                if m is None:
+                    buf.append(line[pos:])
+                    break
+                tok, start = m.group(), m.start()
+                if tok == delim:
+                    buf.append(line[pos:start])
+                    stmt = ''.join(buf).strip()
+                    if not mysql and not sqlite3.complete_statement(stmt + ';'):
+                        # inside CREATE TRIGGER ... BEGIN ... END
+                        buf.append(';')
+                    else:
+                        if stmt:
+                            yield (stmt, delim) if delimiters else stmt
+                        buf = []
+                elif tok in ('--', '#'):
+                    if tok == '#' and not mysql or tok == '--' and mysql and line[m.end():m.end()+1] not in ('', ' ', '\t', '\r', '\n'):
+                        buf.append(line[pos:m.end()])
+                        pos = m.end()
+                        continue
+                    buf.append(line[pos:start] + '\n')
+                    break
+                elif tok == '/*':
+                    if line[m.end():m.end()+1] in ('!', '+'):
+                        buf.append(line[pos:m.end()])
+                        state = '*!'
+                    else:
+                        buf.append(line[pos:start] + ' ')
+                        state = '*/'
+                else:
+                    buf.append(line[pos:m.end()])
+                    state = tok
+                pos = m.end()
+            elif state in ('*/', '*!'):
+                end = line.find('*/', pos)
+                if end < 0:
+                    if state == '*!':
+                        buf.append(line[pos:])
+                    break
+                if state == '*!':
+                    buf.append(line[pos:end+2])
+                state = None
+                pos = end + 2
+            else:
+                m = RE_SQL_QUOTE[state, mysql and state != '`'].search(line, pos)
+                if m is None:
+                    buf.append(line[pos:])
+                    break
+                end = m.end()
+                if m.group() == '\\':
+                    end += 1
+                elif line[end:end+1] == state:
+                    end += 1
+                else:
+                    state = None
+                buf.append(line[pos:end])
+                pos = end
+    stmt = ''.join(buf).strip()
+    if stmt:
+        yield (stmt, delim) if delimiters else stmt
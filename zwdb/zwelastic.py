@@ -1,6 +1,7 @@
 # pylint: disable=arguments-differ
 from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import ConflictError, NotFoundError
+from elasticsearch.helpers import streaming_bulk
 
 from .zwdbase import ZWDbase
 from . import utils
@@ -54,14 +55,35 @@ class ZWElastic(ZWDbase):
             raise ZwdbError(f"Create document error, {ex}, index: {index}, id: {docid}") from ex
         return True
 
-    def insert(self, index, docs, idfld='id', **params):
-        docs = docs if isinstance(docs, list) else [docs]
-        rs = []
-        for doc in docs:
-            docid = doc[idfld] if idfld in doc else None
-            r = self.create(index, docid, doc, **params)
-            rs.append(r)
-        return all(rs)
+    def insert(self, index, docs, idfld='id', chunk_size=None, **params):
+        """
+            Create docs from a doc or any iterable of docs with bulk requests of chunk_size,
+            utils.CHUNK_SIZE by default. Docs whose id already exists are skipped.
+            Returns the count of created docs.
+        """
+        docs = [docs] if isinstance(docs, dict) else docs
+        def actions():
+            for doc in docs:
+                action = {'_op_type': 'create', '_index': index, '_source': doc}
+                if idfld in doc:
+                    action['_id'] = doc[idfld]
+                yield action
+        count = 0
+        try:
+            results = streaming_bulk(self.es, actions(), chunk_size=chunk_size or utils.CHUNK_SIZE,
+                raise_on_error=False, **params)
+            for ok, item in results:
+                if ok:
+                    count += 1
+                elif item['create'].get('status') != 409:
+                    err = item['create']
+                    raise ZwdbError(
+                        f"Create document error, {err.get('error')}, index: {index}, id: {err.get('_id')}")
+        except ZwdbError:
+            raise
+        except Exception as ex:
+            raise ZwdbError(f"Create document error, {ex}, index: {index}") from ex
+        return count
 
     def update(self, index, docs=None, idfld='id', docids=None, script=None, upsert=False, **params):
         """
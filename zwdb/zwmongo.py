@@ -1,5 +1,6 @@
 # pylint: disable=arguments-differ
 import time
+import itertools
 import pymongo
 from pymongo import UpdateOne, DeleteOne
 from pymongo.errors import ConnectionFailure
@@ -9,6 +10,25 @@ from .zwdbase import ZWDbase
 from . import utils
 from .records import DocumentCollection, ZwdbError
 
+# keys per $in/$or query when checking existence of many records
+MONGO_IN_CHUNK = 1000
+
+def _path_values(doc, path):
+    """Scalar values at a dotted path of a found doc, through embedded docs and
+    array elements. They are compared in python, so server side only rules such as
+    collations or positional paths like ``tags.0`` are not applied."""
+    vals = [doc]
+    for part in path.split('.'):
+        vals = [v[part] for v in _elements(vals) if isinstance(v, dict) and part in v]
+    return [v for v in _elements(vals) if not isinstance(v, (list, dict))]
+
+def _elements(vals):
+    for v in vals:
+        if isinstance(v, list):
+            yield from v
+        else:
+            yield v
+
 class ZWMongo(ZWDbase):
     """Class defining a Mongo driver"""
     def __init__(self, db_url, **kwargs):
@@ -61,9 +81,9 @@ class ZWMongo(ZWDbase):
     def lists(self):
         return self.client[self.dbname].list_collection_names()
 
-    def find(self, coll, conds=None, projection=None, sort=None, limit=0, fetchall=False, **params):
+    def find(self, coll, conds=None, projection=None, sort=None, limit=0, fetchall=False, stream=False, **params):
         conn = self.get_connection()
-        docs = conn.find(coll, conds, projection, sort, limit, fetchall, **params)
+        docs = conn.find(coll, conds, projection, sort, limit, fetchall, stream, **params)
         if fetchall:
             conn.close()
         return docs
@@ -77,9 +97,9 @@ class ZWMongo(ZWDbase):
             rtn = conn.groupby(coll, key, conds, sort, limit)
         return rtn
 
-    def insert(self, coll, recs, ordered=False):
+    def insert(self, coll, recs, ordered=False, chunk_size=None):
         with self.get_connection() as conn:
-            rtn = conn.insert(coll, recs, ordered)
+            rtn = conn.insert(coll, recs, ordered, chunk_size)
         return rtn
 
     def update(self, coll, recs, keyflds=None):
@@ -117,12 +137,21 @@ class ZWMongo(ZWDbase):
             rtn = conn.exists(coll, rec, keyflds, conds)
         return rtn
 
+    def exists_many(self, coll, recs, keyflds):
+        if recs and '_id' in (keyflds or []):
+            # only 24 hex strings are ObjectIds, other _id values are stored as they are
+            recs = [dict(rec, _id=ObjectId(rec['_id'])) if isinstance(rec['_id'], str) and ObjectId.is_valid(rec['_id'])
+                else rec for rec in recs]
+        with self.get_connection() as conn:
+            rtn = conn.exists_many(coll, recs, keyflds)
+        return rtn
+
     def drop_collection(self, coll):
         return self.client[self.dbname].drop_collection(coll)
 
-    def leftjoin(self, coll, coll_right, fld, fld_right, nameas, match=None, fetchall=False, **params):
+    def leftjoin(self, coll, coll_right, fld, fld_right, nameas, match=None, fetchall=False, stream=False, **params):
         conn = self.get_connection()
-        rtn = conn.leftjoin(coll, coll_right, fld, fld_right, nameas, match, fetchall, **params)
+        rtn = conn.leftjoin(coll, coll_right, fld, fld_right, nameas, match, fetchall, stream, **params)
         if fetchall:
             conn.close()
         return rtn
@@ -173,12 +202,12 @@ class ZWMongoConnection(object):
             self._close_cursor()
             raise StopIteration('Cursor contains no more docs.')
 
-    def find(self, coll, conds=None, projection=None, sort=None, limit=0, fetchall=False, **params):
+    def find(self, coll, conds=None, projection=None, sort=None, limit=0, fetchall=False, stream=False, **params):
         sort = sort or [('_id', -1)]
         if conds and '_id' in conds and isinstance(conds['_id'], str):
             conds['_id'] = ObjectId(conds['_id'])
         self._cursor = self._db[coll].find(filter=conds, projection=projection, sort=sort, limit=limit, **params)
-        results = DocumentCollection(self)
+        results = DocumentCollection(self, stream=stream and not fetchall)
         if fetchall:
             results.all()
         return results
@@ -204,11 +233,12 @@ class ZWMongoConnection(object):
         # rtn.sort(key=itemgetter('count'), reverse=reverse)
         return rtn
 
-    def insert(self, coll, recs, ordered=False):
-        if recs is None or len(recs) == 0:
-            return 0
-        result = self._db[coll].insert_many(recs, ordered=ordered)
-        return len(result.inserted_ids)
+    def insert(self, coll, recs, ordered=False, chunk_size=None):
+        count = 0
+        for chunk in utils.chunked(recs, chunk_size):
+            result = self._db[coll].insert_many(chunk, ordered=ordered)
+            count += len(result.inserted_ids)
+        return count
 
     def update(self, coll, recs, keyflds=None):
         if recs is None or len(recs) == 0:
@@ -280,7 +310,27 @@ class ZWMongoConnection(object):
             r = list(self._db[coll].find(_conds, projection={'_id': 1}, limit=1))
         return True if len(r)==1 else False
 
-    def leftjoin(self, coll, coll_right, fld, fld_right, nameas, match=None, fetchall=False, **params):
+    def exists_many(self, coll, recs, keyflds):
+        if not recs or not keyflds:
+            return [False]*len(recs or [])
+        keys = [tuple(rec[k] for k in keyflds) for rec in recs]
+        uniq = list(dict.fromkeys(keys))
+        projection = dict({'_id': 0}, **{k: 1 for k in keyflds})
+        existing = set()
+        for i in range(0, len(uniq), MONGO_IN_CHUNK):
+            chunk = uniq[i:i+MONGO_IN_CHUNK]
+            if len(keyflds) == 1:
+                match = {keyflds[0]: {'$in': [k[0] for k in chunk]}}
+            else:
+                match = {'$or': [dict(zip(keyflds, k)) for k in chunk]}
+            wanted = set(chunk)
+            for doc in self._db[coll].find(match, projection=projection):
+                # a missing field matches a None key, as on the server
+                vals = [_path_values(doc, k) or [None] for k in keyflds]
+                existing.update(wanted.intersection(itertools.product(*vals)))
+        return [k in existing for k in keys]
+
+    def leftjoin(self, coll, coll_right, fld, fld_right, nameas, match=None, fetchall=False, stream=False, **params):
         match = match or {}
         query = [{
             '$lookup': {
@@ -300,7 +350,7 @@ class ZWMongoConnection(object):
             })
 
         self._cursor = self._db[coll].aggregate(query)
-        results = DocumentCollection(self)
+        results = DocumentCollection(self, stream=stream and not fetchall)
         if fetchall:
             results.all()
         return results
@@ -1,11 +1,77 @@
 import os
+import re
+import time
+import itertools
+import threading
+import tempfile
+import weakref
+from itertools import islice
+from collections import OrderedDict
 from contextlib import contextmanager
+from functools import lru_cache
+from datetime import datetime
 
 import mysql.connector
-import mysql.connector.pooling
+from mysql.connector import HAVE_CEXT
 
 from . import utils
-from .records import RecordCollection
+from . import sqlcond
+from .records import RecordCollection, ZwdbError
+from .zwmysqlpool import ZWMysqlPool
+from .zwmysqlsession import ZWMysqlSession
+
+MYSQL_BACKENDS = ('pure', 'c', 'auto')
+
+# keys per IN list when looking up existing rows
+MYSQL_IN_CHUNK = 1000
+
+RE_NAMED_PARAM = re.compile(r'%\((\w+)\)s')
+
+@lru_cache(maxsize=1024)
+def _positional(stmt):
+    '''Turn a %(name)s template into a %s template for prepared cursors, return (stmt, names)'''
+    return RE_NAMED_PARAM.sub('%s', stmt), tuple(RE_NAMED_PARAM.findall(stmt))
+
+TSV_ESCAPES = {ord('\\'): '\\\\', ord('\t'): '\\t', ord('\n'): '\\n', ord('\r'): '\\r', ord('\0'): '\\0'}
+
+def _tsv_field(v):
+    '''Format a value for LOAD DATA with the default ESCAPED BY '\\' '''
+    if v is None:
+        return b'\\N'
+    if isinstance(v, bool):
+        return b'1' if v else b'0'
+    if isinstance(v, (bytes, bytearray)):
+        return bytes(v).replace(b'\\', b'\\\\').replace(b'\t', b'\\t').replace(b'\n', b'\\n') \
+            .replace(b'\r', b'\\r').replace(b'\0', b'\\0')
+    if isinstance(v, datetime):
+        v = v.isoformat(' ')
+    elif isinstance(v, str):
+        v = v.translate(TSV_ESCAPES)
+    else:
+        v = str(v)
+    return v.encode('utf-8')
+
+def _tsv_line(row, columns):
+    if isinstance(row, dict):
+        row = [row.get(c) for c in columns]
+    return b'\t'.join([_tsv_field(v) for v in row]) + b'\n'
+
+def _execute_multi(cursor, stmt):
+    '''Run several ';' separated statements in one round trip and drain their results'''
+    try:
+        results = cursor.execute(stmt, multi=True)
+    except TypeError:
+        # connector 9.2+ dropped multi=, statements are split by the server and results read with nextset
+        cursor.execute(stmt)
+        while True:
+            if cursor.with_rows:
+                cursor.fetchall()
+            if not cursor.nextset():
+                break
+        return
+    for r in results:
+        if r.with_rows:
+            r.fetchall()
 
 class ZWMysql(object):
     """Class defining a MySQL driver"""
@@ -26,42 +92,149 @@ class ZWMysql(object):
             'use_unicode'       : p.get('useUnicode', True),
             'connect_timeout'   : p.get('connectTimeout', 10),
         }
+        # zwdb options, not connector options
+        self.arraysize = kwargs.pop('arraysize', 1000)
+        prepared = kwargs.pop('prepared', False)
+        # 'pure', 'c' or 'auto' for the C extension when it is installed, an explicit use_pure wins
+        backend = kwargs.pop('backend', 'pure')
+        if backend not in MYSQL_BACKENDS:
+            raise ValueError('Unknown backend {}, use one of {}.'.format(backend, ', '.join(MYSQL_BACKENDS)))
+        if backend == 'c' and not HAVE_CEXT:
+            raise ZwdbError('mysql-connector C extension is not available.')
+        if 'use_pure' not in kwargs:
+            kwargs['use_pure'] = backend == 'pure' or not HAVE_CEXT
+        self.prepared_cache_size = kwargs.pop('prepared_cache_size', 64)
+        # update batches from this size go through a temp table
+        self.bulk_update_size = kwargs.pop('bulk_update_size', 1000)
+        # zwdb pool options, pool_size is the max size
+        self.poolcfg = {
+            'min_size'      : kwargs.pop('pool_min_size', 0),
+            'timeout'       : kwargs.pop('pool_timeout', 30),
+            'idle_timeout'  : kwargs.pop('pool_idle_timeout', 300),
+            'ping_after'    : kwargs.pop('pool_ping_after', 1.0),
+        }
+        # read replicas, reads go to one of them picked by read_policy
+        replicas = kwargs.pop('replicas', None) or []
+        self.read_policy = kwargs.pop('read_policy', 'round_robin')
+        if self.read_policy not in ('round_robin', 'least_in_use'):
+            raise ValueError('Unknown read_policy {}.'.format(self.read_policy))
+        # calls made inside transaction() on its thread run on the transaction's connection
+        self.read_your_writes = kwargs.pop('read_your_writes', bool(replicas))
+        if prepared and kwargs.get('pool_reset_session'):
+            raise ValueError('prepared=True needs pool_reset_session=False, '
+                'a session reset drops the prepared statements.')
         self.dbcfg.update(kwargs)
+        if prepared:
+            # COM_RESET_CONNECTION on pool checkin would deallocate the cached statements
+            self.dbcfg.setdefault('pool_reset_session', False)
         cfg = {
             'collation' : 'utf8mb4_general_ci',
-            'use_pure'  : True,
             'pool_size' : 5
         }
         for k,v in cfg.items():
             self.dbcfg[k] = self.dbcfg.get(k, v)
         self._debug = False
         self._pool = None
+        self._replicas = []
+        for url in replicas:
+            r = utils.db_url_parser(url)
+            self._replicas.append(dict(self.dbcfg, host=r['host'], port=r['port'] or 3306,
+                user=r['usr'] or self.dbcfg['user'], password=r['pwd'] or self.dbcfg['password'], database=r['db'] or self.dbcfg['database']))
+        self._replica_pools = None
+        self._rr = itertools.count()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # prepared cursor caches per pooled connection
+        self._stmt_caches = weakref.WeakKeyDictionary() if prepared else None
+        # shared by the caches of all connections, updated under _stats_lock
+        self._prepared_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._stats_lock = threading.Lock()
+
+    pool_size = property(lambda self: self._pool.pool_size if self._pool else self.dbcfg['pool_size'])
+    pool_stats = property(lambda self: self._pool.stats() if self._pool else {})
+    replica_stats = property(lambda self: [o.stats() for o in self._replica_pools or []])
 
-    pool_size = property(lambda self: self._pool.pool_size)
+    @property
+    def prepared_stats(self):
+        with self._stats_lock:
+            return dict(self._prepared_stats)
     version = property(lambda _: mysql.connector.__version__)
+    backend = property(lambda self: 'pure' if self.dbcfg['use_pure'] else 'c')
+
+    @property
+    def info(self):
+        '''Return connector version, backend in use, C extension availability and server version'''
+        with self.get_connection() as conn:
+            server_version = conn.conn.server_info
+        return {
+            'version': mysql.connector.__version__,
+            'backend': self.backend,
+            'have_cext': HAVE_CEXT,
+            'server_version': server_version,
+        }
+
+    def _connect(self, dbcfg=None, **kwargs):
+        cfg = {k: v for k, v in (dbcfg or self.dbcfg).items() if not k.startswith('pool_')}
+        cfg.update(kwargs)
+        return mysql.connector.connect(**cfg)
+
+    def _new_pool(self, dbcfg):
+        return ZWMysqlPool(lambda: self._connect(dbcfg), dbcfg['pool_size'],
+            reset_session=dbcfg.get('pool_reset_session', True), **self.poolcfg)
+
+    def _read_pool(self):
+        if self._replica_pools is None:
+            with self._lock:
+                if self._replica_pools is None:
+                    self._replica_pools = [self._new_pool(o) for o in self._replicas]
+        pools = self._replica_pools
+        if self.read_policy == 'least_in_use':
+            return min(pools, key=lambda o: o.in_use)
+        return pools[next(self._rr) % len(pools)]
 
-    def get_connection(self):
-        if not self._pool:
-            self._pool = mysql.connector.pooling.MySQLConnectionPool(**self.dbcfg)
-        conn = self._pool.get_connection()
-        return ZWMysqlConnection(conn, debug=self._debug)
+    def get_connection(self, readonly=False):
+        '''Check out a connection of the primary, or of a replica for readonly use'''
+        pinned = getattr(self._local, 'conn', None)
+        if pinned is not None:
+            return pinned
+        if readonly and self._replicas:
+            pool = self._read_pool()
+        else:
+            if not self._pool:
+                with self._lock:
+                    if not self._pool:
+                        self._pool = self._new_pool(self.dbcfg)
+            pool = self._pool
+        conn = pool.get()
+        stmt_cache = None
+        if self._stmt_caches is not None:
+            cnx = getattr(conn, '_cnx', conn)
+            stmt_cache = self._stmt_caches.get(cnx)
+            if stmt_cache is None:
+                stmt_cache = ZWMysqlStmtCache(self.prepared_cache_size, self._prepared_stats, self._stats_lock)
+                self._stmt_caches[cnx] = stmt_cache
+        return ZWMysqlConnection(conn, debug=self._debug, arraysize=self.arraysize, stmt_cache=stmt_cache,
+            bulk_update_size=self.bulk_update_size, pool=pool)
 
     def close(self):
         if self._pool:
-            # pylint: disable=protected-access
-            self._pool._remove_connections()
+            self._pool.close()
+        for pool in self._replica_pools or []:
+            pool.close()
 
     def lists(self):
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             rs = conn.execute('SHOW TABLES')
             recs = rs.all()
         return recs
 
-    def find(self, tbl, clause=None, fetchall=False, **params):
-        conn = self.get_connection()
-        recs = conn.find(tbl, clause, fetchall, **params)
+    def find(self, tbl, clause=None, fetchall=False, stream=False, arraysize=None, **params):
+        conn = self.get_connection(readonly=True)
+        recs = conn.find(tbl, clause, fetchall, stream, arraysize, **params)
         if fetchall:
             conn.close()
+        else:
+            self._autoclose(conn, recs)
         return recs
 
     def findone(self, tbl, clause=None, **params):
@@ -70,21 +243,90 @@ class ZWMysql(object):
         recs = self.find(tbl, clause=clause, fetchall=True, **params)
         return recs[0] if len(recs)>0 else None
 
+    def parallel_find(self, tbl, split_key='id', partitions=4, merge=True, arraysize=None, **params):
+        """scan key ranges concurrently on dedicated connections, spread over the replicas if any,
+        yield records in no particular order or return per-range iterators, see ZWSqlite.parallel_find
+        """
+        with self.get_connection(readonly=True) as conn:
+            cuts = conn.split_points(tbl, split_key, partitions, **params)
+        bounds = [None] + cuts + [None]
+        cfgs = self._replicas or [self.dbcfg]
+        scans = [self._scan_range(tbl, split_key, bounds[i], bounds[i+1], arraysize, params, cfgs[i % len(cfgs)])
+            for i in range(len(bounds)-1)]
+        return utils.merge_parallel(scans, batch_size=arraysize or self.arraysize) if merge else scans
+
+    def _scan_range(self, tbl, split_key, lo, hi, arraysize, params, dbcfg):
+        # outside the pool, as bulk_load does, so more partitions than pool_size don't wait on checkouts
+        conn = ZWMysqlConnection(self._connect(dbcfg), debug=self._debug, arraysize=self.arraysize,
+            bulk_update_size=self.bulk_update_size)
+        # when the scan is closed early, close() drops the connection with the rest of the range unread
+        with conn:
+            yield from conn.find_range(tbl, split_key, lo, hi, arraysize=arraysize, **params)
+
+    def iter_pages(self, tbl, keyflds='id', page_size=1000, cursor=None, **params):
+        """keyset pagination in ascending key order by NOT NULL key columns, yield (page, cursor),
+        see ZWSqlite.iter_pages
+        """
+        return utils.keyset_pages(lambda: self.get_connection(readonly=True), tbl, keyflds,
+            page_size, cursor, params)
+
     def exists(self, tbl, rec=None, keyflds=None, **params):
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             rtn = conn.exists(tbl, rec, keyflds, **params)
         return rtn
 
+    def exists_many(self, tbl, recs, keyflds):
+        with self.get_connection(readonly=True) as conn:
+            rtn = conn.exists_many(tbl, recs, keyflds)
+        return rtn
+
     def count(self, tbl, **params):
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             rtn = conn.count(tbl, **params)
         return rtn
 
-    def insert(self, tbl, recs):
+    def insert(self, tbl, recs, chunk_size=None):
         with self.get_connection() as conn:
-            rtn = conn.insert(tbl, recs)
+            rtn = conn.insert(tbl, recs, chunk_size)
         return rtn
 
+    def insert_columns(self, tbl, columns, chunk_size=None):
+        with self.get_connection() as conn:
+            rtn = conn.insert_columns(tbl, columns, chunk_size)
+        return rtn
+
+    def bulk_load(self, tbl, rows, columns, chunk_size=100000):
+        '''Load rows with LOAD DATA LOCAL INFILE, return loaded count.
+        rows is any iterable of sequences in columns order (or dicts keyed by column). Every
+        chunk_size rows are spooled to a temp file as tab separated text and loaded and
+        committed on a dedicated connection with local infile enabled. The server must
+        allow it too (local_infile=ON).
+        '''
+        cols = ','.join(columns)
+        stmt = ("LOAD DATA LOCAL INFILE %s INTO TABLE {} CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({})").format(tbl, cols)
+        rc = 0
+        cnx = self._connect(allow_local_infile=True)
+        cursor = cnx.cursor()
+        fd, path = tempfile.mkstemp(prefix='zwdb_', suffix='.tsv')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in utils.chunked(rows, chunk_size):
+                    f.seek(0)
+                    f.truncate()
+                    f.writelines(_tsv_line(r, columns) for r in chunk)
+                    f.flush()
+                    if self._debug:
+                        print('%s <= %d rows'%(stmt, len(chunk)))
+                    cursor.execute(stmt, (path,))
+                    rc += cursor.rowcount
+                    cnx.commit()
+        finally:
+            cursor.close()
+            cnx.close()
+            os.remove(path)
+        return rc
+
     def update(self, tbl, recs, keyflds):
         with self.get_connection() as conn:
             rtn = conn.update(tbl, recs, keyflds)
@@ -95,39 +337,70 @@ class ZWMysql(object):
             rtn = conn.upsert(tbl, recs, keyflds)
         return rtn
 
-    def delete(self, tbl, recs=None, keyflds=None, **params):
+    def delete(self, tbl, recs=None, keyflds=None, chunk_size=None, throttle=None, **params):
         with self.get_connection() as conn:
-            rtn = conn.delete(tbl, recs, keyflds, **params)
+            rtn = conn.delete(tbl, recs, keyflds, chunk_size=chunk_size, throttle=throttle, **params)
         return rtn
 
-    def select(self, stmt, fetchall=True, **params):
-        conn = self.get_connection()
-        rtn =  conn.execute(stmt, fetchall=fetchall, **params)
+    def select(self, stmt, fetchall=True, stream=False, arraysize=None, **params):
+        conn = self.get_connection(readonly=True)
+        rtn =  conn.execute(stmt, fetchall=fetchall, stream=stream, arraysize=arraysize, **params)
         if fetchall:
             conn.close()
+        else:
+            self._autoclose(conn, rtn)
         return rtn
 
-    def exec_script(self, fp):
+    @staticmethod
+    def _autoclose(conn, recs):
+        # a lazy result gives its connection back once exhausted, or when it is dropped unread;
+        # a pinned connection stays with its session/transaction
+        if conn.pinned:
+            return
+        conn.autoclose = True
+        weakref.finalize(recs, conn.close)
+
+    def exec_script(self, fp, restore=False, chunk_size=1000, batch_size=100, progress=None):
+        '''Run sql script file, see :py:meth:`ZWMysqlConnection.exec_script`'''
         with self.get_connection() as conn:
-            # pylint: disable=protected-access
-            cursor = conn._conn.cursor()
-            statement = ''
-            with open(fp, encoding='utf-8') as fs:
-                for line in fs:
-                    if line.strip().startswith('--'):  # ignore sql comment lines
-                        continue
-                    if not line.strip().endswith(';'):  # keep appending lines that don't end in ';'
-                        statement = statement + line
-                    else:  # when you get a line ending in ';' then exec statement and reset for next statement
-                        statement = statement + line
-                        cursor.execute(statement)
-                        statement = ''
-        return True
+            rtn = conn.exec_script(fp, restore, chunk_size, batch_size, progress)
+        return rtn
+
+    def session(self):
+        """A context manager pinning one pooled connection, the yielded session has the
+        same methods as the database and runs them all on that connection, so the
+        checkout and session reset are paid once. Read each result before the next query."""
+        return self._session(self.get_connection())
 
     @contextmanager
+    def _session(self, conn):
+        # a nested session, or one inside a read_your_writes transaction, reuses the
+        # pinned connection and leaves releasing it to its owner
+        pin = not conn.pinned
+        conn.pinned = True
+        try:
+            yield ZWMysqlSession(self, conn)
+        finally:
+            if pin:
+                conn.pinned = False
+                conn.close()
+
     def transaction(self):
-        """A context manager for executing a transaction on this Database."""
-        conn = self.get_connection()
+        """A context manager for executing a transaction on this Database.
+        With read_your_writes, calls on this database from the same thread run
+        on the transaction's connection until it ends, reads included."""
+        return self._transaction(self.get_connection())
+
+    @contextmanager
+    def _transaction(self, conn):
+        if conn.transaction:
+            # joins the enclosing transaction of this thread
+            yield conn
+            return
+        pin = self.read_your_writes and not conn.pinned
+        if pin:
+            conn.pinned = True
+            self._local.conn = conn
         conn.transaction = True
         _conn = conn.conn
         _conn.autocommit = False
@@ -137,8 +410,12 @@ class ZWMysql(object):
             _conn.commit()
         except Exception:
             _conn.rollback()
+            raise
         finally:
             conn.transaction = False
+            if pin:
+                self._local.conn = None
+                conn.pinned = False
             conn.close()
 
     def __repr__(self):
@@ -153,12 +430,24 @@ class ZWMysql(object):
 class ZWMysqlConnection(object):
     conn = property(lambda self: self._conn)
 
-    def __init__(self, conn, debug=False):
+    def __init__(self, conn, debug=False, arraysize=1000, stmt_cache=None, bulk_update_size=1000, pool=None):
         self._conn = conn
+        self._pool = pool
+        self.bulk_update_size = bulk_update_size
         self._cursor = None
+        self._cursor_cached = False
+        self._stmt_cache = stmt_cache
+        self._rowbuf = iter(())
+        self.arraysize = arraysize
+        self._arraysize = arraysize
         self.open = True
+        # close (or give back to pool) once a lazy result set is exhausted
+        self.autoclose = False
         self.transaction = False
+        # pinned by a session, close() keeps the connection checked out
+        self.pinned = False
         self._debug = debug
+        self._max_allowed_packet = None
 
     def __enter__(self):
         return self
@@ -167,39 +456,99 @@ class ZWMysqlConnection(object):
         self.close()
 
     def close(self):
-        self._close_cursor()
-        self._conn.close()
+        if not self.open:
+            return
+        if self.pinned:
+            self._close_cursor()
+            return
+        if self._cursor and self._conn.unread_result:
+            # dropping the connection is cheaper than reading an abandoned result off the wire
+            self._cursor = None
+            self._rowbuf = iter(())
+            if self._pool:
+                self._pool.discard(self._conn)
+            else:
+                self._conn.close()
+        else:
+            self._close_cursor()
+            if self._pool:
+                self._pool.put(self._conn)
+            else:
+                self._conn.close()
         self.open = False
 
+    def _exhausted(self):
+        if self.autoclose:
+            self.close()
+        else:
+            self._close_cursor()
+
     def _close_cursor(self):
+        self._rowbuf = iter(())
         if self._cursor:
-            self._cursor.close()
+            # an unbuffered result has to be read off the wire before the next command,
+            # in arraysize chunks so memory stays flat; a cached cursor keeps its statement prepared
+            if self._conn.unread_result:
+                while self._cursor.fetchmany(self._arraysize):
+                    pass
+            if not self._cursor_cached:
+                self._cursor.close()
             self._cursor = None
+            self._cursor_cached = False
 
     def __next__(self):
-        rec = None
-        if self._cursor:
-            rec = self._cursor.fetchone()
-        if rec:
+        # hand out rows from the local buffer, refill it with one fetchmany per arraysize rows
+        rec = next(self._rowbuf, None)
+        if rec is None and self._cursor:
+            self._rowbuf = iter(self._cursor.fetchmany(self._arraysize))
+            rec = next(self._rowbuf, None)
+        if rec is not None:
             return rec
         else:
-            self._close_cursor()
+            self._exhausted()
             raise StopIteration('Cursor contains no more rows.')
 
-    def execute(self, stmt, commit=False, fetchall=True, **params):
-        '''use execute to run raw sql and we don't want multi stmt in operation(multi=False)
+    def fetchmany(self, size=None):
+        '''Return up to size raw rows, buffered rows first, an empty list once the cursor is exhausted
+        '''
+        size = size or self._arraysize
+        rows = list(islice(self._rowbuf, size))
+        if len(rows) < size and self._cursor:
+            rows.extend(self._cursor.fetchmany(size - len(rows)))
+        if not rows:
+            self._exhausted()
+        return rows
+
+    def execute(self, stmt, commit=False, fetchall=True, stream=False, arraysize=None, prepared=False, **params):
+        '''use execute to run raw sql and we don't want multi stmt in operation(multi=False),
+        prepared runs it on a cached server-side prepared statement if the driver enables them
         '''
         if self._debug:
             print('%s <= %s'%(stmt, params))
         params = params or {}
+        self._arraysize = arraysize or self.arraysize
+        # drop what is left of the previous result, buffered rows included
+        self._close_cursor()
         # Execute the given query
-        self._cursor = self._conn.cursor(buffered=False)
-        self._cursor.execute(stmt, params=params)
+        if prepared and self._stmt_cache is not None:
+            pstmt, names = _positional(stmt)
+            self._cursor = self._stmt_cache.get(self._conn, pstmt)
+            self._cursor_cached = True
+            try:
+                self._cursor.execute(pstmt, tuple(params[k] for k in names))
+            except mysql.connector.Error:
+                self._stmt_cache.discard(pstmt)
+                self._cursor = None
+                self._cursor_cached = False
+                raise
+        else:
+            self._cursor = self._conn.cursor(buffered=False)
+            self._cursor.execute(stmt, params=params)
         keys = self._cursor.column_names
         if commit:
             self._conn.commit()
         row_gen = (keys, self)
-        results = RecordCollection(*row_gen)
+        results = RecordCollection(*row_gen, stream=stream and not fetchall)
         if fetchall:
             results.all()
         return results
@@ -208,6 +557,7 @@ class ZWMysqlConnection(object):
         if self._debug:
             print('%s <= %s'%(stmt, paramslist))
         paramslist = paramslist or []
+        self._close_cursor()
         # Execute the given query
         self._cursor = self._conn.cursor(buffered=False)
         self._cursor.executemany(stmt, paramslist)
@@ -220,65 +570,288 @@ class ZWMysqlConnection(object):
             results.all()
         return results
 
-    def find(self, tbl, clause=None, fetchall=False, **params):
+    def find(self, tbl, clause=None, fetchall=False, stream=False, arraysize=None, **params):
         """select query
         """
         stmt = 'SELECT * FROM {}'.format(tbl)
+        args = {}
         if params:
-            vs = self._get_wheres(**params)
+            vs, args = self._get_wheres(**params)
             stmt += ' WHERE {}'.format(vs)
         if clause:
             for k,v in clause.items():
                 stmt += ' {0} {1}'.format(k, v)
-        params = {k:v for k,v in params.items() if not isinstance(v, dict)}
-        results = self.execute(stmt, commit=False, fetchall=fetchall, **params)
+        results = self.execute(stmt, commit=False, fetchall=fetchall, stream=stream, arraysize=arraysize, prepared=fetchall, **args)
         return results
 
+    def exec_script(self, fp, restore=False, chunk_size=1000, batch_size=100, progress=None):
+        '''Run sql script file, streamed statement by statement and committed every chunk_size statements.
+        Restore mode turns off unique and foreign key checks for the load and sends
+        statements in multi-statement batches of batch_size, for loading dumps.
+        DELIMITER lines are followed, trigger and routine bodies run as single statements.
+        progress is called with a dict of statements, elapsed and rate (statements/sec) after each commit.
+        '''
+        count = 0
+        start = time.monotonic()
+        def report():
+            elapsed = time.monotonic() - start
+            if progress:
+                progress({'statements': count, 'elapsed': elapsed, 'rate': count / elapsed if elapsed else 0.0})
+        cnx = self._conn
+        cursor = cnx.cursor()
+        limit = self._max_packet() // 2
+        batch, size, pending = [], 0, 0
+        def flush():
+            nonlocal size
+            size = 0
+            if len(batch) == 1:
+                cursor.execute(batch[0])
+                if cursor.with_rows:
+                    cursor.fetchall()
+            elif batch:
+                _execute_multi(cursor, ';\n'.join(batch))
+            batch.clear()
+        failed = False
+        try:
+            if restore:
+                cursor.execute('SET SESSION unique_checks=0, foreign_key_checks=0')
+            with open(fp, encoding='utf-8') as fs:
+                for stmt, delim in utils.split_sql(fs, 'mysql', delimiters=True):
+                    # a trigger or routine body read between DELIMITER lines runs on its own
+                    alone = delim != ';'
+                    if batch and (alone or size + len(stmt) > limit):
+                        flush()
+                    batch.append(stmt)
+                    size += len(stmt)
+                    count += 1
+                    pending += 1
+                    if alone or not restore or len(batch) >= batch_size:
+                        flush()
+                    if pending >= chunk_size:
+                        flush()
+                        cnx.commit()
+                        pending = 0
+                        report()
+            flush()
+            cnx.commit()
+        except Exception:
+            failed = True
+            try:
+                cnx.rollback()
+            except mysql.connector.Error:
+                pass
+            raise
+        finally:
+            try:
+                if restore:
+                    cursor.execute('SET SESSION unique_checks=1, foreign_key_checks=1')
+                cursor.close()
+            except mysql.connector.Error:
+                # the connection may be broken by the error being raised, keep that one
+                if not failed:
+                    raise
+        if pending:
+            # the last full chunk was reported when it was committed
+            report()
+        return True
+
+    def split_points(self, tbl, key, partitions, **params):
+        '''Key values cutting the matching rows into at most partitions ranges
+        '''
+        if partitions < 2:
+            return []
+        ws, args = self._get_wheres(**params)
+        r = self.execute('SELECT MIN({0}) AS lo, MAX({0}) AS hi FROM {1} WHERE {2}'.format(key, tbl, ws), **args)[0]
+        if r.lo is None:
+            return []
+        if isinstance(r.lo, int) and isinstance(r.hi, int):
+            return utils.split_points(r.lo, r.hi, partitions)
+        # other key types are cut at row quantiles
+        ws += ' AND {} IS NOT NULL'.format(key)
+        n = self.execute('SELECT COUNT(1) AS n FROM {} WHERE {}'.format(tbl, ws), **args)[0].n
+        stmt = 'SELECT {0} AS k FROM {1} WHERE {2} ORDER BY {0} LIMIT 1 OFFSET {{}}'.format(key, tbl, ws)
+        cuts = {self.execute(stmt.format(n * i // partitions), **args)[0].k for i in range(1, partitions)}
+        return sorted(cuts - {r.lo})
+
+    def find_range(self, tbl, key, lo=None, hi=None, arraysize=None, **params):
+        '''Stream rows with lo <= key < hi, a None bound is open, the range without lower bound includes NULL keys
+        '''
+        ws, args = self._get_wheres(**params)
+        if lo is not None:
+            ws += ' AND {}>=%(_lo)s'.format(key)
+            args['_lo'] = lo
+        if hi is not None:
+            ws += ' AND ({0}<%(_hi)s{1})'.format(key, ' OR {} IS NULL'.format(key) if lo is None else '')
+            args['_hi'] = hi
+        stmt = 'SELECT * FROM {} WHERE {}'.format(tbl, ws)
+        return self.execute(stmt, fetchall=False, stream=True, arraysize=arraysize, **args)
+
+    def find_page(self, tbl, keyflds, page_size, last=None, **params):
+        '''Select one page of rows ordered by keyflds, starting after the key values in last,
+        which must not be NULL
+        '''
+        ws, args = [], {}
+        if params:
+            vs, args = self._get_wheres(**params)
+            ws.append(vs)
+        if last is not None:
+            # k > NULL is never true, paging would stop silently
+            nulls = [k for k, v in zip(keyflds, last) if v is None]
+            if nulls:
+                raise ZwdbError('Key {} is NULL, keyset pagination needs NOT NULL key columns.'.format(','.join(nulls)))
+            ws.append(self._get_seek(keyflds))
+            args.update({'_seek{}'.format(i): v for i, v in enumerate(last)})
+        stmt = 'SELECT * FROM {}'.format(tbl)
+        if ws:
+            stmt += ' WHERE {}'.format(' AND '.join(ws))
+        stmt += ' ORDER BY {} LIMIT {}'.format(','.join(keyflds), int(page_size))
+        return self.execute(stmt, commit=False, fetchall=True, prepared=True, **args)
+
     def exists(self, tbl, rec, keyflds, **params):
         if rec and keyflds:
-            ws = self._get_keyflds(keyflds)
+            ws, args = self._get_keyflds(keyflds)
+            args = dict(rec, **args)
         elif not rec and len(params) > 0:
-            rec = {k: v for k, v in params.items()}
-            ws = self._get_wheres(**params)
+            ws, args = self._get_wheres(**params)
         else:
             return False
         stmt = 'SELECT count(1) AS count FROM {} WHERE {}'.format(tbl, ws)
-        r = self.execute(stmt, commit=False, fetchall=True, **rec)
+        r = self.execute(stmt, commit=False, fetchall=True, prepared=True, **args)
         return r[0].count != 0
 
+    def exists_many(self, tbl, recs, keyflds):
+        if not recs or not keyflds:
+            return [False]*len(recs or [])
+        keys = [tuple(rec[k] for k in keyflds) for rec in recs]
+        pos = {k: i for i, k in enumerate(dict.fromkeys(keys))}
+        found = self._existing_positions(tbl, keyflds, list(pos))
+        return [pos[k] in found for k in keys]
+
     def count(self, tbl, **params):
-        ws = self._get_wheres(**params)
+        ws, args = self._get_wheres(**params)
         stmt = 'SELECT count(1) AS count FROM {} WHERE {}'.format(tbl, ws)
-        params = {k:v for k,v in params.items() if not isinstance(v, dict)}
-        r = self.execute(stmt, commit=False, fetchall=True, **params)
+        r = self.execute(stmt, commit=False, fetchall=True, prepared=True, **args)
         return r[0].count
 
-    def insert(self, tbl, recs):
-        if recs is None or len(recs) == 0:
+    def insert(self, tbl, recs, chunk_size=None):
+        stmt = None
+        commit = not self.transaction
+        count = 0
+        for chunk in utils.chunked(recs, chunk_size):
+            if stmt is None:
+                ks = chunk[0].keys()
+                fs = ','.join(ks)
+                vs = ','.join(['%({})s'.format(s) for s in ks])
+                stmt = 'INSERT INTO {} ({}) VALUES({})'.format(tbl, fs, vs)
+            rc = self.executemany(stmt, paramslist=chunk, commit=commit, fetchall=False)
+            count += rc._rows._cursor.rowcount
+            self._close_cursor()
+        return count
+
+    def insert_columns(self, tbl, columns, chunk_size=None):
+        if not columns:
             return 0
-        ks = recs[0].keys()
-        fs = ','.join(ks)
-        vs = ','.join(['%({})s'.format(s) for s in ks])
-        stmt = 'INSERT INTO {} ({}) VALUES({})'.format(tbl, fs, vs)
+        ks, rows = utils.zip_columns(columns)
+        stmt = 'INSERT INTO {} ({}) VALUES({})'.format(tbl, ','.join(ks), ','.join(['%s']*len(ks)))
         commit = not self.transaction
-        rc = self.executemany(stmt, paramslist=recs, commit=commit, fetchall=False)
-        return rc._rows._cursor.rowcount
+        count = 0
+        for chunk in utils.chunked(rows, chunk_size):
+            rc = self.executemany(stmt, paramslist=chunk, commit=commit, fetchall=False)
+            count += rc._rows._cursor.rowcount
+            self._close_cursor()
+        return count
 
     def update(self, tbl, recs, keyflds):
         if recs is None or len(recs) == 0:
             return 0
+        # records of the same key count once and the last one wins, whichever path runs
+        keys = [k for k in keyflds if isinstance(k, str)]
+        if keys:
+            recs = list({tuple(r[k] for k in keys): r for r in recs}.values())
+        if len(recs) >= self.bulk_update_size and all(isinstance(k, str) for k in keyflds):
+            return self._update_bulk(tbl, recs, keyflds)
         rec = recs[0]
         ks = rec.keys()
         vs = ','.join(['{0}=%({0})s'.format(s) for s in ks])
-        ws = self._get_keyflds(keyflds)
+        ws, args = self._get_keyflds(keyflds)
+        if args:
+            recs = [dict(r, **args) for r in recs]
         stmt = 'UPDATE {} SET {} WHERE {}'.format(tbl, vs, ws)
         commit = not self.transaction
         rc = self.executemany(stmt, paramslist=recs, commit=commit, fetchall=False)
         return rc._rows._cursor.rowcount
 
+    def _update_bulk(self, tbl, recs, keyflds):
+        '''Load recs, one per key, into a temporary table with multi-row inserts
+        and apply them with one UPDATE ... JOIN
+        '''
+        ks = list(recs[0].keys())
+        us = ','.join(['t.{0}=s.{0}'.format(k) for k in ks if k not in keyflds])
+        if not us:
+            return 0
+        tmp = '_zwdb_update'
+        on = ' AND '.join(['t.{0}=s.{0}'.format(k) for k in keyflds])
+        vs = ','.join(['%({})s'.format(k) for k in ks])
+        stmt = 'INSERT INTO {} ({}) VALUES({})'.format(tmp, ','.join(ks), vs)
+        # CREATE/DROP TEMPORARY TABLE do not commit implicitly (ALTER TABLE would), so the
+        # index is declared with the table
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute('DROP TEMPORARY TABLE IF EXISTS {}'.format(tmp))
+            cursor.execute('CREATE TEMPORARY TABLE {} (INDEX ({})) SELECT {} FROM {} LIMIT 0'.format(
+                tmp, ','.join(keyflds), ','.join(ks), tbl))
+            for chunk in self._packet_chunks(recs):
+                cursor.executemany(stmt, chunk)
+            cursor.execute('UPDATE {} t JOIN {} s ON {} SET {}'.format(tbl, tmp, on, us))
+            rc = cursor.rowcount
+            cursor.execute('DROP TEMPORARY TABLE {}'.format(tmp))
+            if not self.transaction:
+                self._conn.commit()
+        except Exception:
+            if not self.transaction:
+                self._conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        return rc
+
     def upsert(self, tbl, recs, keyflds):
+        '''Insert or update recs located by keyflds, return (inserted, updated). Keys matching
+        a unique index go in multi-row INSERT ... ON DUPLICATE KEY UPDATE statements.
+        Affected rows can not tell an insert (1) from an update leaving the row as it was
+        (0, or 1 with FOUND_ROWS), so the counts come from a key lookup locked FOR UPDATE in
+        the upsert's transaction. Under READ COMMITTED missing keys are not gap locked, a row
+        another writer inserts between the lookup and the INSERT is counted as an insert.
+        '''
         if recs is None or len(recs) == 0:
             return 0
+        if not self._is_unique_key(tbl, keyflds):
+            return self._upsert_rowwise(tbl, recs, keyflds)
+        ks = list(recs[0].keys())
+        fs = ','.join(ks)
+        vs = ','.join(['%({})s'.format(s) for s in ks])
+        us = ','.join(['{0}=VALUES({0})'.format(s) for s in ks if s not in keyflds]) or '{0}={0}'.format(keyflds[0])
+        stmt = 'INSERT INTO {} ({}) VALUES({}) ON DUPLICATE KEY UPDATE {}'.format(tbl, fs, vs, us)
+
+        # count like the row-wise path, the lookup locks the keys until the commit
+        if not self.transaction and not self._conn.in_transaction:
+            self._conn.start_transaction()
+        keys = list(dict.fromkeys(tuple(rec[k] for k in keyflds) for rec in recs))
+        try:
+            ic = len(keys) - len(self._existing_positions(tbl, keyflds, keys, lock=True))
+            # executemany rewrites each chunk into one multi-row INSERT
+            for chunk in self._packet_chunks(recs):
+                self.executemany(stmt, paramslist=chunk, commit=False, fetchall=False)
+                self._close_cursor()
+            if not self.transaction:
+                self._conn.commit()
+        except Exception:
+            if not self.transaction:
+                self._conn.rollback()
+            raise
+        return ic, len(recs) - ic
+
+    def _upsert_rowwise(self, tbl, recs, keyflds):
         recs_update = []
         recs_insert = []
         for idx,rec in enumerate(recs):
@@ -290,15 +863,20 @@ class ZWMysqlConnection(object):
             else:
                 recs_update.append(rec)
         ic = self.insert(tbl, recs_insert)
-        uc = self.update(tbl, recs_update, keyflds)
-        return ic, uc
+        self.update(tbl, recs_update, keyflds)
+        # every record not inserted counts as an update, as on the set-based path
+        return ic, len(recs) - ic
 
-    def delete(self, tbl, recs, keyflds, **params):
+    def delete(self, tbl, recs, keyflds, chunk_size=None, throttle=None, **params):
+        if recs and keyflds and all(isinstance(k, str) for k in keyflds):
+            return self._delete_keys(tbl, recs, keyflds, chunk_size, throttle)
         if recs and keyflds:
-            ws = self._get_keyflds(keyflds)
+            ws, args = self._get_keyflds(keyflds)
+            if args:
+                recs = [dict(r, **args) for r in recs]
         elif not recs and len(params) > 0:
-            recs = [{k: v for k, v in params.items()}]
-            ws = self._get_wheres(**params)
+            ws, args = self._get_wheres(**params)
+            recs = [args]
         else:
             return 0
         stmt = 'DELETE FROM {} WHERE {}'.format(tbl, ws)
@@ -306,50 +884,125 @@ class ZWMysqlConnection(object):
         rc = self.executemany(stmt, paramslist=recs, commit=commit, fetchall=False)
         return rc._rows._cursor.rowcount
 
-    def _cond_map(self, o):
-        hm = {
-            None: 'ISNULL(%s)',
-            'like': '%s LIKE %s',
-            '<>': '%s <> %s',
-            '>': '%s > %s',
-            '>=': '%s >= %s',
-            '<': '%s < %s',
-            '<=': '%s <= %s',
-        }
-        fld, val = list(o.items())[0]
-        k, v = list(val.items())[0] if isinstance(val, dict) else (None, None)
-        k = k if k is None else k.lower()
-        if k is None:
-            s = hm[k] % fld
-        elif k == 'or':
-            s = ' OR '.join([f'{fld}="{t}"' if isinstance(t, str) else f'{fld}={t}' for t in v])
-        elif k == 'range':
-            vs = v[0]
-            ve = v[1]
-            vs = f'{fld}>="{vs}"' if isinstance(vs, str) else f'{fld}>={vs}'
-            ve = f'{fld}<"{ve}"' if isinstance(ve, str) else f'{fld}<{ve}'
-            s = ' AND '.join([vs, ve])
-        elif k in hm:
-            v = f'"{v}"' if isinstance(v, str) else v
-            s = hm[k] % (fld, v)
-        else:
-            s = '%s %s'%(fld, v)
-        if s:
-            s = f'({s})'
-        return s
+    def _delete_keys(self, tbl, recs, keyflds, chunk_size=None, throttle=None):
+        '''Delete by key with one DELETE ... IN per chunk, all chunks in one transaction.
+        Throttled deletes commit every chunk and pause, so row locks on the primary
+        are held briefly and replicas can keep up. Inside transaction() nothing commits,
+        so throttle is ignored there
+        '''
+        keys = list(dict.fromkeys(tuple(rec[k] for k in keyflds) for rec in recs))
+        size = max(1, chunk_size or MYSQL_IN_CHUNK)
+        commit = not self.transaction
+        rc = 0
+        cursor = self._conn.cursor()
+        try:
+            for i in range(0, len(keys), size):
+                chunk = keys[i:i+size]
+                stmt = 'DELETE FROM {} WHERE {}'.format(tbl, self._key_in(keyflds, len(chunk)))
+                args = [v for k in chunk for v in k]
+                if self._debug:
+                    print('%s <= %s'%(stmt, args))
+                cursor.execute(stmt, args)
+                rc += cursor.rowcount
+                # inside a transaction the locks stay held, pausing would only hold them longer
+                if throttle and commit and i + size < len(keys):
+                    self._conn.commit()
+                    time.sleep(throttle)
+            if commit:
+                self._conn.commit()
+        except Exception:
+            if commit:
+                self._conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        return rc
 
-    def _get_keyflds(self, keyflds):
-        ws = ['{0}=%({0})s'.format(k) if isinstance(k, str) else self._cond_map(k) for k in keyflds]
-        ws.append('1=1')
-        ws = ' AND '.join(ws)
-        return ws
+    def _key_in(self, keyflds, count):
+        if len(keyflds) == 1:
+            return '{} IN ({})'.format(keyflds[0], ','.join(['%s']*count))
+        row = '({})'.format(','.join(['%s']*len(keyflds)))
+        return '({}) IN ({})'.format(','.join(keyflds), ','.join([row]*count))
+
+    def _is_unique_key(self, tbl, keyflds):
+        '''keyflds are plain columns matching exactly the primary key or a unique index of tbl
+        '''
+        if not keyflds or not all(isinstance(k, str) for k in keyflds):
+            return False
+        cursor = self._conn.cursor(dictionary=True)
+        cursor.execute('SHOW INDEX FROM {} WHERE Non_unique=0'.format(tbl))
+        idxs = {}
+        for r in cursor.fetchall():
+            idxs.setdefault(r['Key_name'], set()).add(r['Column_name'])
+        cursor.close()
+        return set(keyflds) in idxs.values()
+
+    def _existing_positions(self, tbl, keyflds, keys, lock=False):
+        '''Return the positions in keys of the key tuples found in tbl. Each chunk is one IN query
+        reading the matching keys back, the server compares them with the column type and collation.
+        A key read back differently (a case or trailing space variant, '3' for 3) matched
+        through the collation or a conversion, the chunk's other keys are then checked with exists.
+        Such a variant sent in the same chunk as the stored value itself is not caught.
+        lock reads with FOR UPDATE, locking the found rows and the gaps of the missing keys.
+        '''
+        found = set()
+        cursor = self._conn.cursor()
+        for i in range(0, len(keys), MYSQL_IN_CHUNK):
+            chunk = keys[i:i+MYSQL_IN_CHUNK]
+            stmt = 'SELECT DISTINCT {} FROM {} WHERE {}{}'.format(','.join(keyflds), tbl,
+                self._key_in(keyflds, len(chunk)), ' FOR UPDATE' if lock else '')
+            args = [v for k in chunk for v in k]
+            if self._debug:
+                print('%s <= %s'%(stmt, args))
+            cursor.execute(stmt, args)
+            rows = {tuple(r) for r in cursor.fetchall()}
+            hits = [j for j, k in enumerate(chunk) if k in rows]
+            if len(hits) < len(rows):
+                hits = [j for j, k in enumerate(chunk) if k in rows
+                    or self.exists(tbl, dict(zip(keyflds, k)), keyflds)]
+            found.update(i+j for j in hits)
+        cursor.close()
+        return found
+
+    def _max_packet(self):
+        if not self._max_allowed_packet:
+            cursor = self._conn.cursor()
+            cursor.execute('SELECT @@max_allowed_packet')
+            self._max_allowed_packet = cursor.fetchone()[0]
+            cursor.close()
+        return self._max_allowed_packet
+
+    def _packet_chunks(self, recs):
+        '''Split recs so a multi-row statement of each chunk stays well below max_allowed_packet
+        '''
+        limit = self._max_packet() // 2
+        chunk, size = [], 0
+        for rec in recs:
+            # escaped utf8mb4 text may take 4 bytes per char, other values a few dozen
+            n = sum([len(v)*4 if isinstance(v, (str, bytes)) else 32 for v in rec.values()])
+            if chunk and size + n > limit:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(rec)
+            size += n
+        if chunk:
+            yield chunk
 
     def _get_wheres(self, **params):
-        ks = params.keys()
-        ws = ['{0}=%({0})s'.format(k) if not any([isinstance(params[k], dict), params[k] is None]) else self._cond_map({k:params[k]}) for k in ks]
-        ws.append('1=1')
-        ws = ' AND '.join(ws)
-        return ws
+        return sqlcond.compile_wheres(params, 'pyformat')
+
+    def _get_keyflds(self, keyflds):
+        return sqlcond.compile_keyflds(keyflds, 'pyformat')
+
+    def _get_seek(self, keyflds):
+        # k0>v0 for one key, k0>=v0 AND (k0>v0 OR (k1>=v1 AND (k1>v1 OR ...))) for composite keys,
+        # the leading k0>=v0 keeps it an index range scan
+        s = None
+        for i in reversed(range(len(keyflds))):
+            v = '%(_seek{})s'.format(i)
+            gt = '{}>{}'.format(keyflds[i], v)
+            s = gt if s is None else '{0}>={1} AND ({2} OR ({3}))'.format(keyflds[i], v, gt, s)
+        return '({})'.format(s)
 
     def _exist_in_recs(self, idx, recs, keyflds):
         rec = recs[idx]
@@ -363,3 +1016,42 @@ class ZWMysqlConnection(object):
             if is_equal:
                 return True
         return False
+
+class ZWMysqlStmtCache(object):
+    """LRU cache of prepared cursors of one connection, keyed by sql template"""
+    def __init__(self, size, stats, lock):
+        self.size = size
+        self.stats = stats
+        self._lock = lock
+        self._cursors = OrderedDict()
+
+    def get(self, conn, stmt):
+        cursor = self._cursors.get(stmt)
+        if cursor is not None:
+            self._cursors.move_to_end(stmt)
+            self._count('hits')
+            return cursor
+        self._count('misses')
+        cursor = conn.cursor(prepared=True)
+        self._cursors[stmt] = cursor
+        if len(self._cursors) > self.size:
+            _, old = self._cursors.popitem(last=False)
+            old.close()
+            self._count('evictions')
+        return cursor
+
+    def _count(self, key):
+        # the stats are shared with the caches of other connections on other threads
+        with self._lock:
+            self.stats[key] += 1
+
+    def discard(self, stmt):
+        cursor = self._cursors.pop(stmt, None)
+        if cursor is not None:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                pass
+
+    def __len__(self):
+        return len(self._cursors)
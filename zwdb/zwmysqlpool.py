@@ -0,0 +1,187 @@
+import time
+import queue
+import bisect
+import threading
+
+import mysql.connector
+
+from .records import ZwdbError
+
+class ZWMysqlPool(object):
+    """Pool of mysql connections with a blocking checkout.
+
+    Checkouts wait up to timeout for a connection once pool_size connections
+    are in use. Connections idle longer than ping_after are pinged before they
+    are handed out, the ones idle longer than idle_timeout are closed down to
+    min_size. stats() reports usage for sizing the pool.
+    """
+    # upper bounds in ms of the checkout wait histogram buckets, plus one for longer waits
+    WAIT_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+    WAIT_LABELS = ['<={}ms'.format(b) for b in WAIT_BUCKETS] + ['>{}ms'.format(WAIT_BUCKETS[-1])]
+
+    def __init__(self, connect, pool_size, min_size=0, timeout=30, idle_timeout=300, ping_after=1.0, reset_session=True):
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        # signalled when a connection is put back or a slot frees up
+        self._cond = threading.Condition(self._lock)
+        self._size = 0
+        self.pool_size = pool_size
+        self.min_size = min(min_size, pool_size)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self.reset_session = reset_session
+        self.closed = False
+        self._in_use = 0
+        self._reaped = time.monotonic()
+        self.reset_stats()
+        for _ in range(self.min_size):
+            self._size += 1
+            self._idle.put((self._new(), time.monotonic()))
+
+    size = property(lambda self: self._size)
+    in_use = property(lambda self: self._in_use)
+
+    def _new(self):
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def get(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        while True:
+            with self._cond:
+                while True:
+                    if self.closed:
+                        raise ZwdbError('Mysql connection pool is closed.')
+                    try:
+                        cnx, used = self._idle.get_nowait()
+                        break
+                    except queue.Empty:
+                        pass
+                    if self._size < self.pool_size:
+                        # a free slot, connect outside the lock
+                        self._size += 1
+                        cnx, used = None, None
+                        break
+                    remain = timeout - (time.monotonic() - start)
+                    if remain <= 0:
+                        self._timeouts += 1
+                        raise ZwdbError('No mysql connection available in pool after {}s.'.format(timeout))
+                    self._cond.wait(remain)
+            if cnx is None:
+                cnx = self._new()
+            elif time.monotonic() - used >= self.ping_after and not self._ping(cnx):
+                self._discard(cnx)
+                continue
+            break
+        wait = (time.monotonic() - start) * 1000
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += wait
+            self._waits[bisect.bisect_left(self.WAIT_BUCKETS, wait)] += 1
+        return cnx
+
+    def put(self, cnx):
+        with self._lock:
+            self._in_use -= 1
+        # reading an unread result off the wire could take long, the connection is dropped instead
+        if self.closed or cnx.unread_result:
+            self._discard(cnx)
+            return
+        try:
+            if self.reset_session:
+                cnx.reset_session()
+            elif cnx.in_transaction:
+                cnx.rollback()
+        except mysql.connector.Error:
+            self._discard(cnx)
+            return
+        now = time.monotonic()
+        with self._cond:
+            self._idle.put((cnx, now))
+            self._cond.notify()
+        if now - self._reaped > self.idle_timeout / 2:
+            self._reap(now)
+
+    def discard(self, cnx):
+        '''Close a checked out connection instead of putting it back'''
+        with self._lock:
+            self._in_use -= 1
+        self._discard(cnx)
+
+    def _ping(self, cnx):
+        try:
+            cnx.ping()
+        except mysql.connector.Error:
+            return False
+        return True
+
+    def _reap(self, now):
+        '''Close connections idle longer than idle_timeout, keeping min_size open'''
+        self._reaped = now
+        conns = []
+        while True:
+            try:
+                conns.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        # LIFO queue, conns[0] was used last
+        for cnx, used in reversed(conns):
+            if now - used > self.idle_timeout and self._size > self.min_size:
+                self._discard(cnx)
+            else:
+                self._idle.put((cnx, used))
+        with self._cond:
+            self._cond.notify_all()
+
+    def _discard(self, cnx):
+        try:
+            cnx.close()
+        except mysql.connector.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            # a waiter may open a new connection in the freed slot
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        while True:
+            try:
+                cnx, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(cnx)
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._since
+            return {
+                'size'              : self._size,
+                'in_use'            : self._in_use,
+                'idle'              : self._idle.qsize(),
+                'checkouts'         : self._checkouts,
+                'checkouts_per_sec' : self._checkouts / elapsed if elapsed else 0.0,
+                'timeouts'          : self._timeouts,
+                'wait_avg_ms'       : self._wait_total / self._checkouts if self._checkouts else 0.0,
+                'wait_histogram'    : dict(zip(self.WAIT_LABELS, self._waits)),
+            }
+
+    def reset_stats(self):
+        '''Restart the counters, checkouts_per_sec is measured from here'''
+        with self._lock:
+            self._since = time.monotonic()
+            self._checkouts = 0
+            self._timeouts = 0
+            self._wait_total = 0.0
+            self._waits = [0] * len(self.WAIT_LABELS)
@@ -0,0 +1,84 @@
+from . import utils
+from .records import ZwdbError
+
+class ZWMysqlSession(object):
+    """One pooled connection of a ZWMysql pinned for many calls, see :py:meth:`ZWMysql.session`.
+    The session holds the database and its connection, and runs the database methods on it."""
+    # pylint: disable=protected-access
+    def __init__(self, db, conn):
+        self.db = db
+        self._conn = conn
+
+    def get_connection(self, readonly=False): # pylint: disable=unused-argument
+        return self._conn
+
+    def lists(self):
+        return self._conn.execute('SHOW TABLES').all()
+
+    def find(self, tbl, clause=None, fetchall=False, stream=False, arraysize=None, **params):
+        return self._conn.find(tbl, clause, fetchall, stream, arraysize, **params)
+
+    def findone(self, tbl, clause=None, **params):
+        clause = clause or {}
+        clause['limit'] = 1
+        recs = self.find(tbl, clause=clause, fetchall=True, **params)
+        return recs[0] if len(recs)>0 else None
+
+    def parallel_find(self, *args, **kwargs):
+        raise ZwdbError('parallel_find scans on several connections, call it on the database, not a session')
+
+    def iter_pages(self, tbl, keyflds='id', page_size=1000, cursor=None, **params):
+        return utils.keyset_pages(self.get_connection, tbl, keyflds, page_size, cursor, params)
+
+    def exists(self, tbl, rec=None, keyflds=None, **params):
+        return self._conn.exists(tbl, rec, keyflds, **params)
+
+    def exists_many(self, tbl, recs, keyflds):
+        return self._conn.exists_many(tbl, recs, keyflds)
+
+    def count(self, tbl, **params):
+        return self._conn.count(tbl, **params)
+
+    def insert(self, tbl, recs, chunk_size=None):
+        return self._conn.insert(tbl, recs, chunk_size)
+
+    def insert_columns(self, tbl, columns, chunk_size=None):
+        return self._conn.insert_columns(tbl, columns, chunk_size)
+
+    def bulk_load(self, tbl, rows, columns, chunk_size=100000):
+        # loads on a dedicated connection with local infile enabled, as on the database
+        return self.db.bulk_load(tbl, rows, columns, chunk_size)
+
+    def update(self, tbl, recs, keyflds):
+        return self._conn.update(tbl, recs, keyflds)
+
+    def upsert(self, tbl, recs, keyflds):
+        return self._conn.upsert(tbl, recs, keyflds)
+
+    def delete(self, tbl, recs=None, keyflds=None, chunk_size=None, throttle=None, **params):
+        return self._conn.delete(tbl, recs, keyflds, chunk_size=chunk_size, throttle=throttle, **params)
+
+    def select(self, stmt, fetchall=True, stream=False, arraysize=None, **params):
+        return self._conn.execute(stmt, fetchall=fetchall, stream=stream, arraysize=arraysize, **params)
+
+    def exec_script(self, fp, restore=False, chunk_size=1000, batch_size=100, progress=None):
+        return self._conn.exec_script(fp, restore, chunk_size, batch_size, progress)
+
+    def session(self):
+        return self.db._session(self._conn)
+
+    def transaction(self):
+        return self.db._transaction(self._conn)
+
+    def close(self):
+        # the connection goes back to the pool when the session ends
+        pass
+
+    def __repr__(self):
+        return '<Session host={}:{}>'.format(self.db.dbcfg['host'], self.db.dbcfg['port'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, val, traceback):
+        self.close()
@@ -1,7 +1,59 @@
+import os
+import re
 import sqlite3
 import traceback
+import weakref
 import logging
-from .records import RecordCollection
+import time
+from contextlib import contextmanager
+from itertools import islice
+from urllib.parse import urlparse, parse_qsl
+from urllib.request import pathname2url
+from . import utils
+from . import sqlcond
+from .records import RecordCollection, ZwdbError
+from .zwsqlitepool import ZWSqlitePool
+from .zwsqlitewriter import ZWSqliteWriter
+
+# host parameter limit of sqlite builds before 3.32
+SQLITE_MAX_VARIABLES = 999
+# composite key IN (VALUES ...) needs row values, 3.15+, UPDATE ... FROM needs 3.33+
+SQLITE_ROW_VALUES = sqlite3.sqlite_version_info >= (3, 15, 0)
+SQLITE_UPDATE_FROM = sqlite3.sqlite_version_info >= (3, 33, 0)
+# keys per OR-ed key clause without row values, kept under the expression depth limit
+SQLITE_OR_KEYS = 100
+
+# pragmas applied to every new connection, settable by kwargs or uri query
+SQLITE_PRAGMAS = ('journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store', 'busy_timeout')
+# transaction control in scripts, exec_script manages transactions itself;
+# ROLLBACK TO a savepoint is left to run
+RE_SQLITE_TXN = re.compile(r'(BEGIN(\s+(DEFERRED|IMMEDIATE|EXCLUSIVE))?|COMMIT|END)(\s+TRANSACTION)?$', re.I)
+RE_SQLITE_ROLLBACK = re.compile(r'ROLLBACK(\s+TRANSACTION)?$', re.I)
+# statements exec_script runs outside a transaction
+SQLITE_NOTXN_VERBS = ('PRAGMA', 'VACUUM', 'ATTACH', 'DETACH')
+SQLITE_PROFILES = {
+    'bulk_load': {
+        'journal_mode'  : 'WAL',
+        'synchronous'   : 'OFF',
+        'cache_size'    : -262144,      # 256MB
+        'temp_store'    : 'MEMORY',
+        'busy_timeout'  : 30000,
+    },
+    'read_heavy': {
+        'journal_mode'  : 'WAL',
+        'synchronous'   : 'NORMAL',
+        'mmap_size'     : 268435456,    # 256MB
+        'cache_size'    : -65536,       # 64MB
+        'temp_store'    : 'MEMORY',
+        'busy_timeout'  : 5000,
+    },
+    'durable': {
+        'journal_mode'  : 'WAL',
+        'synchronous'   : 'FULL',
+        'cache_size'    : -16384,       # 16MB
+        'busy_timeout'  : 5000,
+    },
+}
 
 class ZWSqlite(object):
     """Class defining a sqlite driver"""
@@ -11,12 +63,26 @@ class ZWSqlite(object):
         self.dbcfg = {
         }
         self.dburl = db_url
+        # profile and pragmas in uri query are ignored by sqlite itself
+        if self.isuri:
+            qs = dict(parse_qsl(urlparse(str(db_url)).query))
+            self.dbcfg.update({k: v for k, v in qs.items() if k == 'profile' or k in SQLITE_PRAGMAS})
         self.dbcfg.update(kwargs)
         cfgdef = {
+            'arraysize': 1000,
+            'pool_size': 0,         # 0 opens a new connection per call
+            'pool_timeout': 30,     # seconds to wait for a free pooled connection
+            'bulk_update_size': 1000,   # update batches from this size go through a temp table
         }
         for k, v in cfgdef.items():
             self.dbcfg[k] = self.dbcfg.get(k, v)
         self.debug = self.dbcfg.get('debug', False)
+        profile = self.dbcfg.get('profile')
+        if profile and profile not in SQLITE_PROFILES:
+            raise ValueError('Unknown sqlite profile {}, use one of {}.'.format(profile, ', '.join(SQLITE_PROFILES)))
+        self.pragmas = dict(SQLITE_PROFILES.get(profile, {}))
+        self.pragmas.update({k: self.dbcfg[k] for k in SQLITE_PRAGMAS if k in self.dbcfg})
+        self._pool = ZWSqlitePool(self._connect, self.dbcfg['pool_size']) if self.dbcfg['pool_size'] else None
 
     @property
     def version(self):
@@ -25,18 +91,55 @@ class ZWSqlite(object):
 
     @property
     def info(self):
-        '''Return version and sqlite_version'''
+        '''Return version, sqlite_version, profile and pragma settings in effect'''
+        with self.get_connection() as conn:
+            pragmas = {k: conn.conn.execute('PRAGMA {}'.format(k)).fetchone()[0] for k in SQLITE_PRAGMAS}
         return {
             'sqlite_version': sqlite3.sqlite_version,
             'version': sqlite3.version,
+            'profile': self.dbcfg.get('profile'),
+            'pragmas': pragmas,
         }
 
+    pool_size = property(lambda self: self._pool.pool_size if self._pool else 0)
+
+    def _connect(self, readonly=False):
+        if readonly:
+            return self._connect_ro()
+        # pooled connections are checked out by any thread, one at a time
+        conn = sqlite3.connect(self.dburl, uri=self.isuri, check_same_thread=self._pool is None)
+        for k, v in self.pragmas.items():
+            conn.execute('PRAGMA {}={}'.format(k, v))
+        return conn
+
+    def _ro_url(self):
+        url = str(self.dburl)
+        path = urlparse(url).path if self.isuri else url
+        if path in ('', ':memory:') or 'mode=memory' in url:
+            raise ZwdbError('Read-only connections need a database file, not {}.'.format(url))
+        if self.isuri:
+            return url + ('&mode=ro' if '?' in url else '?mode=ro')
+        return 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(url)))
+
+    def _connect_ro(self):
+        conn = sqlite3.connect(self._ro_url(), uri=True)
+        for k, v in self.pragmas.items():
+            # the journal mode can not be changed read-only
+            if k != 'journal_mode':
+                conn.execute('PRAGMA {}={}'.format(k, v))
+        return conn
+
     def get_connection(self):
-        conn = sqlite3.connect(self.dburl, uri=self.isuri)
-        return ZWSqliteConnection(conn, debug=self.debug)
+        if self._pool:
+            conn = self._pool.get(timeout=self.dbcfg['pool_timeout'])
+        else:
+            conn = self._connect()
+        return ZWSqliteConnection(conn, debug=self.debug, arraysize=self.dbcfg['arraysize'], pool=self._pool,
+            bulk_update_size=self.dbcfg['bulk_update_size'])
 
     def close(self):
-        pass
+        if self._pool:
+            self._pool.close()
 
     def lists(self):
         '''List all tables in database'''
@@ -44,12 +147,14 @@ class ZWSqlite(object):
             recs = conn.execute("SELECT name FROM sqlite_master WHERE type='table' order by name", fetchall=True)
         return recs
 
-    def find(self, tbl, clause=None, fetchall=False, **params):
+    def find(self, tbl, clause=None, fetchall=False, stream=False, arraysize=None, **params):
         '''Select records from table
 
         :param str tbl: table name
         :param dict clause: clause setting such as LIMIT, ORDER BY
         :param bool fetchall: fetch all or not
+        :param bool stream: forward only iteration without caching rows, ignored if fetchall
+        :param int arraysize: rows pulled per fetchmany, default to dbcfg arraysize
         :param dict params: select where condition
         :return: result set
         :rtype: :py:class:`zwtk.sqlite.RecordCollection`
@@ -63,9 +168,11 @@ class ZWSqlite(object):
             db.find('tbl', num={'or': (2, 3)})
         '''
         conn = self.get_connection()
-        recs = conn.find(tbl, clause, fetchall, **params)
+        recs = conn.find(tbl, clause, fetchall, stream, arraysize, **params)
         if fetchall:
             conn.close()
+        else:
+            self._autoclose(conn, recs)
         return recs
 
     def findone(self, tbl, clause=None, **params):
@@ -87,6 +194,59 @@ class ZWSqlite(object):
         recs = self.find(tbl, clause=clause, fetchall=True, **params)
         return recs[0] if len(recs)>0 else None
 
+    def parallel_find(self, tbl, split_key='id', partitions=4, merge=True, arraysize=None, **params):
+        '''Scan a table in key ranges concurrently, each range on its own read-only connection.
+        Integer keys are split into ranges of equal width between MIN and MAX, other keys at
+        row quantiles. Rows whose split_key is NULL belong to the first range.
+
+        :param str tbl: table name
+        :param str split_key: indexed column the ranges are cut on
+        :param int partitions: number of ranges, scanned by as many threads when merged
+        :param bool merge: yield all rows from one iterator, in no particular order, or
+            return a list of per-range iterators to hand to parallel consumers
+        :param int arraysize: rows pulled per fetchmany
+        :param dict params: select where condition
+        :return: iterator of records, or list of iterators of records
+
+        .. code-block:: Python
+            :linenos:
+
+            for r in db.parallel_find('tbl', split_key='id', partitions=8, num={'>': 0}):
+                print(r.id)
+        '''
+        self._ro_url()
+        with self.get_connection() as conn:
+            cuts = conn.split_points(tbl, split_key, partitions, **params)
+        bounds = [None] + cuts + [None]
+        scans = [self._scan_range(tbl, split_key, bounds[i], bounds[i+1], arraysize, params) for i in range(len(bounds)-1)]
+        return utils.merge_parallel(scans, batch_size=arraysize or self.dbcfg['arraysize']) if merge else scans
+
+    def _scan_range(self, tbl, split_key, lo, hi, arraysize, params):
+        # opened on first next(), on the thread consuming it
+        with ZWSqliteConnection(self._connect(readonly=True), debug=self.debug, arraysize=self.dbcfg['arraysize']) as conn:
+            yield from conn.find_range(tbl, split_key, lo, hi, arraysize=arraysize, **params)
+
+    def iter_pages(self, tbl, keyflds='id', page_size=1000, cursor=None, **params):
+        '''Iterate table pages in ascending key order with keyset pagination
+        (WHERE key > last ORDER BY key LIMIT n), each page costs the same however deep it is.
+        Key columns must be NOT NULL, a NULL key in the last row of a page raises ZwdbError.
+
+        :param str tbl: table name
+        :param str/list(str) keyflds: unique NOT NULL key field(s) to page by
+        :param int page_size: rows per page
+        :param str cursor: token from a previous page to resume after it
+        :param dict params: select where condition
+        :return: generator of (page, cursor), page is a fetched result set, cursor resumes after it
+        :rtype: generator
+
+        .. code-block:: Python
+            :linenos:
+
+            for page, cursor in db.iter_pages('tbl', keyflds=['id'], page_size=500, none=None):
+                save(page.all(), cursor)
+        '''
+        return utils.keyset_pages(self.get_connection, tbl, keyflds, page_size, cursor, params)
+
     def exists(self, tbl, rec=None, keyflds=None, **params):
         '''Check existence of record
 
@@ -107,6 +267,25 @@ class ZWSqlite(object):
             rtn = conn.exists(tbl, rec, keyflds, **params)
         return rtn
 
+    def exists_many(self, tbl, recs, keyflds):
+        '''Check existence of a batch of records with a few chunked join queries, keys compare
+        as sqlite compares them (column affinity and collation), as in exists
+
+        :param str tbl: table name
+        :param list(dict{str, object}) recs: record dict list
+        :param list(str) keyflds: key field list
+        :return: existence of each record, in input order
+        :rtype: list(bool)
+
+        .. code-block:: Python
+            :linenos:
+
+            db.exists_many('tbl', [{'id': 1}, {'id': 99}], keyflds=['id'])  # [True, False]
+        '''
+        with self.get_connection() as conn:
+            rtn = conn.exists_many(tbl, recs, keyflds)
+        return rtn
+
     def count(self, tbl, **params):
         '''Get table count by where condition in params
 
@@ -119,11 +298,12 @@ class ZWSqlite(object):
             rtn = conn.count(tbl, **params)
         return rtn
 
-    def insert(self, tbl, recs):
+    def insert(self, tbl, recs, chunk_size=None):
         '''Insert recs into table, return insert count
 
         :param str tbl: table name
-        :param list(dict{str, object}) recs: record dict list
+        :param iterable(dict{str, object}) recs: record dicts, any iterable such as a generator
+        :param int chunk_size: records per batch, each batch is committed; lists go in one batch by default
         :return: insert count
         :rtype: int
 
@@ -135,9 +315,29 @@ class ZWSqlite(object):
                 {'txt': 'txt2', 'num': 2, 'dt': datetime.now()},
             ]
             db.insert('tbl', recs)
+            db.insert('tbl', (json.loads(line) for line in f), chunk_size=5000)
         '''
         with self.get_connection() as conn:
-            rtn = conn.insert(tbl, recs)
+            rtn = conn.insert(tbl, recs, chunk_size)
+        return rtn
+
+    def insert_columns(self, tbl, columns, chunk_size=None):
+        '''Insert column-wise data, rows are zipped lazily from the columns and bound
+        as positional tuples, no dict is built per row. Return insert count
+
+        :param str tbl: table name
+        :param dict{str, sequence} columns: column name to values, lists, arrays or numpy arrays of equal length
+        :param int chunk_size: rows per batch, each batch is committed
+        :return: insert count
+        :rtype: int
+
+        .. code-block:: Python
+            :linenos:
+
+            db.insert_columns('tbl', {'txt': ['txt1', 'txt2'], 'num': np.array([1, 2])})
+        '''
+        with self.get_connection() as conn:
+            rtn = conn.insert_columns(tbl, columns, chunk_size)
         return rtn
 
     def update(self, tbl, recs, keyflds):
@@ -146,7 +346,7 @@ class ZWSqlite(object):
         :param str tbl: table name
         :param list(dict{str, object}) recs: record dict list
         :param list(str) keyflds: key field(s) list used to locate records
-        :return: update count
+        :return: update count, rows updated; records with the same key count once, the last one wins
         :rtype: int
 
         .. code-block:: Python
@@ -184,12 +384,16 @@ class ZWSqlite(object):
             rtn = conn.upsert(tbl, recs, keyflds)
         return rtn
 
-    def delete(self, tbl, recs=None, keyflds=None, **params):
-        '''Delete recs by record list or where condition, return delete count
+    def delete(self, tbl, recs=None, keyflds=None, chunk_size=None, throttle=None, **params):
+        '''Delete recs by record list or where condition, return delete count.
+        Records located by plain key fields are deleted with chunked ``IN`` lists in one transaction.
 
         :param str tbl: table name
         :param list(dict{str, object}) recs: record dict list
         :param list(str) keyflds: key field(s) list used to locate records
+        :param int chunk_size: keys per DELETE, defaults to the most the variable limit allows
+        :param float throttle: seconds to pause between chunks, each chunk is then committed on its own;
+            ignored inside transaction(), which commits once at its end
         :param dict params: select where condition
         :return: delete
         :rtype: int
@@ -202,16 +406,19 @@ class ZWSqlite(object):
             ]
             db.delete('tbl', recs, keyflds=['id'])
             db.delete('tbl', dt=None)
+            db.delete('tbl', expired, keyflds=['id'], chunk_size=500, throttle=0.05)
         '''
         with self.get_connection() as conn:
-            rtn = conn.delete(tbl, recs, keyflds, **params)
+            rtn = conn.delete(tbl, recs, keyflds, chunk_size=chunk_size, throttle=throttle, **params)
         return rtn
 
-    def select(self, stmt, fetchall=True, **params):
+    def select(self, stmt, fetchall=True, stream=False, arraysize=None, **params):
         '''Run raw select sql
 
         :param str stmt: sql statement
         :param bool fetchall: fetch all records
+        :param bool stream: forward only iteration without caching rows, ignored if fetchall
+        :param int arraysize: rows pulled per fetchmany, default to dbcfg arraysize
         :param dict params: select where condition
         :return: result set
         :rtype: :py:class:`zwtk.sqlite.RecordCollection`
@@ -222,15 +429,30 @@ class ZWSqlite(object):
             db.select('SELECT txt FROM tbl WHERE id=1')
         '''
         conn = self.get_connection()
-        rtn =  conn.execute(stmt, fetchall=fetchall, **params)
+        rtn =  conn.execute(stmt, fetchall=fetchall, stream=stream, arraysize=arraysize, **params)
         if fetchall:
             conn.close()
+        else:
+            self._autoclose(conn, rtn)
         return rtn
 
-    def exec_script(self, fp):
-        '''Run sql script file
+    def _autoclose(self, conn, recs):
+        # a lazy result closes its connection once exhausted, a pooled one also
+        # goes back to the pool when the result is dropped unread
+        conn.autoclose = True
+        if self._pool:
+            weakref.finalize(recs, conn.close)
+
+    def exec_script(self, fp, chunk_size=10000, progress=None):
+        '''Run sql script file. The file is streamed statement by statement and
+        statements run in transactions of chunk_size, the script's own
+        BEGIN/COMMIT/END are ignored. A ROLLBACK in the script can not undo the
+        chunks already committed, it fails the run like an error: the current
+        chunk is rolled back and False returned.
 
         :param str fp: sql file path
+        :param int chunk_size: statements per transaction
+        :param callable progress: called with a dict of statements, elapsed and rate (statements/sec) after each transaction
         :return: success or not
         :rtype: bool
 
@@ -238,26 +460,102 @@ class ZWSqlite(object):
             :linenos:
 
             db.exec_script('C:/data.sql')
+            db.exec_script('C:/dump.sql', chunk_size=50000, progress=lambda o: print(o['rate']))
         '''
+        count = 0
+        pending = 0
+        start = time.monotonic()
+        def report(notify=True):
+            elapsed = time.monotonic() - start
+            stats = {'statements': count, 'elapsed': elapsed, 'rate': count / elapsed if elapsed else 0.0}
+            logging.debug('exec_script %s: %d statements, %.0f/s', fp, count, stats['rate'])
+            if progress and notify:
+                progress(stats)
+            return stats
         try:
             with self.get_connection() as conn:
-                statement = ''
-                with open(fp, encoding='utf-8') as fs:
-                    for line in fs:
-                        line = line.strip()
-                        if line.startswith('--'):  # ignore sql comment lines
-                            continue
-                        if not line.endswith(';'):  # keep appending lines that don't end in ';'
-                            statement = statement + line
-                        else:  # when you get a line ending in ';' then exec statement and reset for next statement
-                            statement = statement + line
-                            conn.execute(statement)
-                            statement = ''
+                # pylint: disable=protected-access
+                cnx = conn._conn
+                try:
+                    with open(fp, encoding='utf-8') as fs:
+                        for stmt in utils.split_sql(fs):
+                            verb = stmt.split(None, 1)[0].upper()
+                            if RE_SQLITE_TXN.match(stmt) or verb.startswith('/*') and stmt.endswith('*/'):
+                                # mysql conditional comments are no-ops here
+                                continue
+                            if RE_SQLITE_ROLLBACK.match(stmt):
+                                raise ZwdbError('Script rolls back after statement {}.'.format(count))
+                            if verb in SQLITE_NOTXN_VERBS:
+                                # can not run inside a transaction
+                                if cnx.in_transaction:
+                                    cnx.commit()
+                            elif not cnx.in_transaction:
+                                cnx.execute('BEGIN')
+                            cnx.execute(stmt)
+                            count += 1
+                            pending += 1
+                            if pending >= chunk_size:
+                                if cnx.in_transaction:
+                                    cnx.commit()
+                                pending = 0
+                                report()
+                    if cnx.in_transaction:
+                        cnx.commit()
+                except Exception:
+                    # transactions committed before the failing chunk stay applied
+                    if cnx.in_transaction:
+                        cnx.rollback()
+                    raise
         except Exception:
             logging.error(traceback.format_exc())
             return False
+        # the last full chunk was reported when it was committed
+        stats = report(notify=pending > 0)
+        logging.info('exec_script %s: %d statements in %.1fs, %.0f/s', fp, count, stats['elapsed'], stats['rate'])
         return True
 
+    @contextmanager
+    def transaction(self):
+        '''A context manager running all operations on the yielded connection in one commit
+
+        .. code-block:: Python
+            :linenos:
+
+            with db.transaction() as conn:
+                conn.insert('tbl', recs)
+                conn.delete('tbl', dt=None)
+        '''
+        conn = self.get_connection()
+        conn.transaction = True
+        _conn = conn.conn
+        if not _conn.in_transaction:
+            _conn.execute('BEGIN')
+        try:
+            yield conn
+            _conn.commit()
+        except Exception:
+            _conn.rollback()
+            raise
+        finally:
+            conn.transaction = False
+            conn.close()
+
+    def group_writer(self, interval=0.05, max_batch=1000):
+        '''Return a writer coalescing writes submitted from many threads into periodic commits
+
+        :param float interval: seconds a batch stays open for more writes
+        :param int max_batch: operations committed together at most
+        :rtype: :py:class:`ZWSqliteWriter`
+
+        .. code-block:: Python
+            :linenos:
+
+            with db.group_writer() as w:
+                fut = w.insert('tbl', recs)
+                fut.result()    # insert count, once committed
+        '''
+        return ZWSqliteWriter(self, interval, max_batch)
+
     def __repr__(self):
         return '<Database dburl={}>'.format(self.dburl)
 
@@ -270,10 +568,17 @@ class ZWSqlite(object):
 class ZWSqliteConnection(object):
     conn = property(lambda self: self._conn)
 
-    def __init__(self, conn, debug=False):
+    def __init__(self, conn, debug=False, arraysize=1000, pool=None, bulk_update_size=1000):
         self._conn = conn
+        self.bulk_update_size = bulk_update_size
+        self._pool = pool
         self._cursor = None
+        self._rowbuf = iter(())
+        self.arraysize = arraysize
+        self._arraysize = arraysize
         self.open = True
+        # close (or give back to pool) once a lazy result set is exhausted
+        self.autoclose = False
 
         self.transaction = False
         self._debug = debug
@@ -291,37 +596,63 @@ class ZWSqliteConnection(object):
 
     def _close_conn(self):
         if self._conn:
-            self._conn.close()
+            if self._pool:
+                self._pool.put(self._conn)
+            else:
+                self._conn.close()
             self._conn = None
 
+    def _exhausted(self):
+        if self.autoclose:
+            self.close()
+        else:
+            self._close_cursor()
+
     def _close_cursor(self):
+        self._rowbuf = iter(())
         if self._cursor:
             self._cursor.close()
             self._cursor = None
 
     def __next__(self):
-        rec = None
-        if self._cursor:
-            rec = self._cursor.fetchone()
-        if rec:
+        # hand out rows from the local buffer, refill it with one fetchmany per arraysize rows
+        rec = next(self._rowbuf, None)
+        if rec is None and self._cursor:
+            self._rowbuf = iter(self._cursor.fetchmany(self._arraysize))
+            rec = next(self._rowbuf, None)
+        if rec is not None:
             return rec
         else:
-            self._close_cursor()
+            self._exhausted()
             raise StopIteration('Cursor contains no more rows.')
 
-    def execute(self, stmt, commit=False, fetchall=True, **params):
+    def fetchmany(self, size=None):
+        '''Return up to size raw rows, buffered rows first, an empty list once the cursor is exhausted
+        '''
+        size = size or self._arraysize
+        rows = list(islice(self._rowbuf, size))
+        if len(rows) < size and self._cursor:
+            rows.extend(self._cursor.fetchmany(size - len(rows)))
+        if not rows:
+            self._exhausted()
+        return rows
+
+    def execute(self, stmt, commit=False, fetchall=True, stream=False, arraysize=None, **params):
         '''use execute to run raw sql and we don't want multi stmt in operation(multi=False)
         '''
         if self._debug:
             print('%s <= %s'%(stmt, params))
         params = params or {}
+        self._arraysize = arraysize or self.arraysize
+        # drop what is left of the previous result, buffered rows included
+        self._close_cursor()
         # Execute the given query
         self._cursor = self._conn.execute(stmt, params)
         keys = [o[0] for o in self._cursor.description] if self._cursor.description else None
         if commit:
             self._conn.commit()
         row_gen = (keys, self)
-        results = RecordCollection(*row_gen)
+        results = RecordCollection(*row_gen, stream=stream and not fetchall)
         if fetchall:
             results.all()
         return results
@@ -330,6 +661,7 @@ class ZWSqliteConnection(object):
         if self._debug:
             print('%s <= %s'%(stmt, paramslist))
         paramslist = paramslist or []
+        self._close_cursor()
         # Execute the given query
         self._cursor = self._conn.executemany(stmt, paramslist)
         keys = [o[0] for o in self._cursor.description] if self._cursor.description else None
@@ -341,63 +673,197 @@ class ZWSqliteConnection(object):
             results.all()
         return results
 
-    def find(self, tbl, clause=None, fetchall=False, **params):
+    def find(self, tbl, clause=None, fetchall=False, stream=False, arraysize=None, **params):
         stmt = 'SELECT * FROM {}'.format(tbl)
+        args = {}
         if params:
-            vs = self._get_wheres(**params)
+            vs, args = self._get_wheres(**params)
             stmt += ' WHERE {}'.format(vs)
         if clause:
             for k,v in clause.items():
                 stmt += ' {0} {1}'.format(k, v)
-        params = {k:v for k,v in params.items() if not isinstance(v, dict)}
-        results = self.execute(stmt, commit=False, fetchall=fetchall, **params)
+        results = self.execute(stmt, commit=False, fetchall=fetchall, stream=stream, arraysize=arraysize, **args)
         return results
 
+    def split_points(self, tbl, key, partitions, **params):
+        '''Key values cutting the matching rows into at most partitions ranges
+        '''
+        if partitions < 2:
+            return []
+        ws, args = self._get_wheres(**params)
+        r = self.execute('SELECT MIN({0}) AS lo, MAX({0}) AS hi FROM {1} WHERE {2}'.format(key, tbl, ws), **args)[0]
+        if r.lo is None:
+            return []
+        if isinstance(r.lo, int) and isinstance(r.hi, int):
+            return utils.split_points(r.lo, r.hi, partitions)
+        # other key types are cut at row quantiles
+        ws += ' AND {} IS NOT NULL'.format(key)
+        n = self.execute('SELECT COUNT(1) AS n FROM {} WHERE {}'.format(tbl, ws), **args)[0].n
+        stmt = 'SELECT {0} AS k FROM {1} WHERE {2} ORDER BY {0} LIMIT 1 OFFSET {{}}'.format(key, tbl, ws)
+        cuts = {self.execute(stmt.format(n * i // partitions), **args)[0].k for i in range(1, partitions)}
+        return sorted(cuts - {r.lo})
+
+    def find_range(self, tbl, key, lo=None, hi=None, arraysize=None, **params):
+        '''Stream rows with lo <= key < hi, a None bound is open, the range without lower bound includes NULL keys
+        '''
+        ws, args = self._get_wheres(**params)
+        if lo is not None:
+            ws += ' AND {}>=:_lo'.format(key)
+            args['_lo'] = lo
+        if hi is not None:
+            ws += ' AND ({0}<:_hi{1})'.format(key, ' OR {} IS NULL'.format(key) if lo is None else '')
+            args['_hi'] = hi
+        stmt = 'SELECT * FROM {} WHERE {}'.format(tbl, ws)
+        return self.execute(stmt, fetchall=False, stream=True, arraysize=arraysize, **args)
+
+    def find_page(self, tbl, keyflds, page_size, last=None, **params):
+        '''Select one page of rows ordered by keyflds, starting after the key values in last,
+        which must not be NULL
+        '''
+        ws, args = [], {}
+        if params:
+            vs, args = self._get_wheres(**params)
+            ws.append(vs)
+        if last is not None:
+            # k > NULL is never true, paging would stop silently
+            nulls = [k for k, v in zip(keyflds, last) if v is None]
+            if nulls:
+                raise ZwdbError('Key {} is NULL, keyset pagination needs NOT NULL key columns.'.format(','.join(nulls)))
+            ws.append(self._get_seek(keyflds))
+            args.update({'_seek{}'.format(i): v for i, v in enumerate(last)})
+        stmt = 'SELECT * FROM {}'.format(tbl)
+        if ws:
+            stmt += ' WHERE {}'.format(' AND '.join(ws))
+        stmt += ' ORDER BY {} LIMIT {}'.format(','.join(keyflds), int(page_size))
+        return self.execute(stmt, commit=False, fetchall=True, **args)
+
     def exists(self, tbl, rec, keyflds, **params):
         if rec and keyflds:
-            ws = self._get_keyflds(keyflds)
+            ws, args = self._get_keyflds(keyflds)
+            args = dict(rec, **args)
         elif not rec and len(params) > 0:
-            rec = {k: v for k, v in params.items()}
-            ws = self._get_wheres(**params)
+            ws, args = self._get_wheres(**params)
         else:
             return False
         stmt = 'SELECT count(1) AS count FROM {} WHERE {}'.format(tbl, ws)
-        r = self.execute(stmt, commit=False, fetchall=True, **rec)
+        r = self.execute(stmt, commit=False, fetchall=True, **args)
         return r[0].count != 0
 
+    def exists_many(self, tbl, recs, keyflds):
+        if not recs or not keyflds:
+            return [False]*len(recs or [])
+        keys = [tuple(rec[k] for k in keyflds) for rec in recs]
+        pos = {k: i for i, k in enumerate(dict.fromkeys(keys))}
+        found = self._existing_positions(tbl, keyflds, list(pos))
+        return [pos[k] in found for k in keys]
+
     def count(self, tbl, **params):
-        ws = self._get_wheres(**params)
+        ws, args = self._get_wheres(**params)
         stmt = 'SELECT count(1) AS count FROM {} WHERE {}'.format(tbl, ws)
-        params = {k:v for k,v in params.items() if not isinstance(v, dict)}
-        r = self.execute(stmt, commit=False, fetchall=True, **params)
+        r = self.execute(stmt, commit=False, fetchall=True, **args)
         return r[0].count
 
-    def insert(self, tbl, recs):
-        if recs is None or len(recs) == 0:
+    def insert(self, tbl, recs, chunk_size=None):
+        stmt = None
+        commit = not self.transaction
+        count = 0
+        for chunk in utils.chunked(recs, chunk_size):
+            if stmt is None:
+                ks = chunk[0].keys()
+                fs = ','.join(ks)
+                vs = ','.join([':{}'.format(s) for s in ks])
+                stmt = 'INSERT INTO {} ({}) VALUES({})'.format(tbl, fs, vs)
+            rc = self.executemany(stmt, paramslist=chunk, commit=commit, fetchall=False)
+            count += rc._rows._cursor.rowcount
+        return count
+
+    def insert_columns(self, tbl, columns, chunk_size=None):
+        if not columns:
             return 0
-        ks = recs[0].keys()
-        fs = ','.join(ks)
-        vs = ','.join([':{}'.format(s) for s in ks])
-        stmt = 'INSERT INTO {} ({}) VALUES({})'.format(tbl, fs, vs)
+        ks, rows = utils.zip_columns(columns)
+        stmt = 'INSERT INTO {} ({}) VALUES({})'.format(tbl, ','.join(ks), ','.join('?'*len(ks)))
         commit = not self.transaction
-        rc = self.executemany(stmt, paramslist=recs, commit=commit, fetchall=False)
-        return rc._rows._cursor.rowcount
+        count = 0
+        for chunk in utils.chunked(rows, chunk_size):
+            rc = self.executemany(stmt, paramslist=chunk, commit=commit, fetchall=False)
+            count += rc._rows._cursor.rowcount
+        return count
 
     def update(self, tbl, recs, keyflds):
         if recs is None or len(recs) == 0:
             return 0
+        # records of the same key count once and the last one wins, whichever path runs
+        keys = [k for k in keyflds if isinstance(k, str)]
+        if keys:
+            recs = list({tuple(r[k] for k in keys): r for r in recs}.values())
+        if len(recs) >= self.bulk_update_size and SQLITE_UPDATE_FROM \
+                and all(isinstance(k, str) for k in keyflds):
+            return self._update_bulk(tbl, recs, keyflds)
         rec = recs[0]
         ks = rec.keys()
         vs = ','.join(['{0}=:{0}'.format(s) for s in ks])
-        ws = self._get_keyflds(keyflds)
+        ws, args = self._get_keyflds(keyflds)
+        if args:
+            recs = [dict(r, **args) for r in recs]
         stmt = 'UPDATE {} SET {} WHERE {}'.format(tbl, vs, ws)
         commit = not self.transaction
         rc = self.executemany(stmt, paramslist=recs, commit=commit, fetchall=False)
         return rc._rows._cursor.rowcount
 
+    def _update_bulk(self, tbl, recs, keyflds):
+        '''Load recs, one per key, into a temp table and apply them with one UPDATE ... FROM
+        '''
+        ks = list(recs[0].keys())
+        us = ','.join(['{0}=s.{0}'.format(k) for k in ks if k not in keyflds])
+        if not us:
+            return 0
+        tmp = '_zwdb_update'
+        on = ' AND '.join(['{0}.{1}=s.{1}'.format(tbl, k) for k in keyflds])
+        commit = not self.transaction
+        try:
+            self._conn.execute('DROP TABLE IF EXISTS temp.{}'.format(tmp))
+            self._conn.execute('CREATE TEMP TABLE {} AS SELECT {} FROM {} LIMIT 0'.format(tmp, ','.join(ks), tbl))
+            self._conn.execute('CREATE INDEX temp.{0}_key ON {0} ({1})'.format(tmp, ','.join(keyflds)))
+            vs = ','.join([':{}'.format(k) for k in ks])
+            self.executemany('INSERT INTO temp.{} ({}) VALUES({})'.format(tmp, ','.join(ks), vs), paramslist=recs, fetchall=False)
+            stmt = 'UPDATE {} SET {} FROM temp.{} AS s WHERE {}'.format(tbl, us, tmp, on)
+            rc = self.execute(stmt, commit=False, fetchall=False)._rows._cursor.rowcount
+            self._conn.execute('DROP TABLE temp.{}'.format(tmp))
+            if commit:
+                self._conn.commit()
+        except Exception:
+            if commit:
+                self._conn.rollback()
+            raise
+        return rc
+
     def upsert(self, tbl, recs, keyflds):
         if recs is None or len(recs) == 0:
             return 0
+        if not self._is_conflict_target(tbl, keyflds):
+            return self._upsert_rowwise(tbl, recs, keyflds)
+        ks = list(recs[0].keys())
+        fs = ','.join(ks)
+        vs = ','.join([':{}'.format(s) for s in ks])
+        us = ','.join(['{0}=excluded.{0}'.format(s) for s in ks if s not in keyflds])
+        action = 'DO UPDATE SET {}'.format(us) if us else 'DO NOTHING'
+        stmt = 'INSERT INTO {} ({}) VALUES({}) ON CONFLICT({}) {}'.format(tbl, fs, vs, ','.join(keyflds), action)
+
+        # count like the row-wise path: first occurrence of a new key inserts, everything else updates
+        if not self._conn.in_transaction:
+            self._conn.execute('BEGIN IMMEDIATE')
+        keys = list(dict.fromkeys(tuple(rec[k] for k in keyflds) for rec in recs))
+        ic = len(keys) - len(self._existing_positions(tbl, keyflds, keys))
+        commit = not self.transaction
+        try:
+            self.executemany(stmt, paramslist=recs, commit=commit, fetchall=False)
+        except Exception:
+            if commit:
+                self._conn.rollback()
+            raise
+        return ic, len(recs) - ic
+
+    def _upsert_rowwise(self, tbl, recs, keyflds):
         recs_update = []
         recs_insert = []
         for idx,rec in enumerate(recs):
@@ -409,15 +875,20 @@ class ZWSqliteConnection(object):
             else:
                 recs_update.append(rec)
         ic = self.insert(tbl, recs_insert)
-        uc = self.update(tbl, recs_update, keyflds)
-        return ic, uc
+        self.update(tbl, recs_update, keyflds)
+        # every record not inserted counts as an update, as on the set-based path
+        return ic, len(recs) - ic
 
-    def delete(self, tbl, recs, keyflds, **params):
+    def delete(self, tbl, recs, keyflds, chunk_size=None, throttle=None, **params):
+        if recs and keyflds and all(isinstance(k, str) for k in keyflds):
+            return self._delete_keys(tbl, recs, keyflds, chunk_size, throttle)
         if recs and keyflds:
-            ws = self._get_keyflds(keyflds)
+            ws, args = self._get_keyflds(keyflds)
+            if args:
+                recs = [dict(r, **args) for r in recs]
         elif not recs and len(params) > 0:
-            recs = [{k: v for k, v in params.items()}]
-            ws = self._get_wheres(**params)
+            ws, args = self._get_wheres(**params)
+            recs = [args]
         else:
             return 0
         stmt = 'DELETE FROM {} WHERE {}'.format(tbl, ws)
@@ -425,51 +896,102 @@ class ZWSqliteConnection(object):
         rc = self.executemany(stmt, paramslist=recs, commit=commit, fetchall=False)
         return rc._rows._cursor.rowcount
 
+    def _delete_keys(self, tbl, recs, keyflds, chunk_size=None, throttle=None):
+        '''Delete by key with one DELETE ... IN per chunk, all chunks in one transaction
+        unless throttled, then every chunk commits and the lock is released during the pause.
+        Inside transaction() nothing commits, so throttle is ignored there
+        '''
+        keys = list(dict.fromkeys(tuple(rec[k] for k in keyflds) for rec in recs))
+        size = max(1, min(chunk_size or SQLITE_MAX_VARIABLES, SQLITE_MAX_VARIABLES // len(keyflds)))
+        if len(keyflds) > 1 and not SQLITE_ROW_VALUES:
+            size = min(size, SQLITE_OR_KEYS)
+        commit = not self.transaction
+        rc = 0
+        try:
+            for i in range(0, len(keys), size):
+                chunk = keys[i:i+size]
+                stmt = 'DELETE FROM {} WHERE {}'.format(tbl, self._key_in(keyflds, len(chunk)))
+                args = [v for k in chunk for v in k]
+                if self._debug:
+                    print('%s <= %s'%(stmt, args))
+                rc += self._conn.execute(stmt, args).rowcount
+                # inside a transaction the locks stay held, pausing would only hold them longer
+                if throttle and commit and i + size < len(keys):
+                    self._conn.commit()
+                    time.sleep(throttle)
+            if commit:
+                self._conn.commit()
+        except Exception:
+            if commit:
+                self._conn.rollback()
+            raise
+        return rc
+
+    def _key_in(self, keyflds, count):
+        '''Where clause matching count key tuples, composite keys as row values on sqlite 3.15+
+        and as OR-ed equality groups before
+        '''
+        if len(keyflds) == 1:
+            return '{} IN ({})'.format(keyflds[0], ','.join('?'*count))
+        if not SQLITE_ROW_VALUES:
+            group = '({})'.format(' AND '.join(['{}=?'.format(k) for k in keyflds]))
+            return ' OR '.join([group]*count)
+        row = '({})'.format(','.join('?'*len(keyflds)))
+        return '({}) IN (VALUES {})'.format(','.join(keyflds), ','.join([row]*count))
+
+    def _is_conflict_target(self, tbl, keyflds):
+        '''keyflds are plain columns matching exactly the primary key or a unique index of tbl
+        '''
+        if sqlite3.sqlite_version_info < (3, 24, 0) or not keyflds or not all(isinstance(k, str) for k in keyflds):
+            return False
+        target = set(keyflds)
+        cols = self._conn.execute('PRAGMA table_info({})'.format(tbl)).fetchall()
+        if target == {c[1] for c in cols if c[5]}:
+            return True
+        for idx in self._conn.execute('PRAGMA index_list({})'.format(tbl)).fetchall():
+            # seq, name, unique, origin, partial
+            if idx[2] and not (len(idx) > 4 and idx[4]):
+                idxcols = self._conn.execute('PRAGMA index_info({})'.format(idx[1])).fetchall()
+                if target == {c[2] for c in idxcols}:
+                    return True
+        return False
+
+    def _existing_positions(self, tbl, keyflds, keys):
+        '''Return the positions in keys of the key tuples found in tbl, joined against a VALUES
+        table of (position, key) so sqlite itself decides equality
+        '''
+        found = set()
+        n = len(keyflds)
+        vs = ','.join(['k{}'.format(j) for j in range(n)])
+        # table column on the left, its affinity and collation apply
+        on = ' AND '.join(['t.{}=v.k{}'.format(k, j) for j, k in enumerate(keyflds)])
+        row = ','.join('?'*n)
+        size = SQLITE_MAX_VARIABLES // n
+        for i in range(0, len(keys), size):
+            chunk = keys[i:i+size]
+            values = ','.join(['({},{})'.format(i+j, row) for j in range(len(chunk))])
+            stmt = 'WITH v(i,{}) AS (VALUES {}) SELECT DISTINCT v.i FROM v JOIN {} t ON {}'.format(vs, values, tbl, on)
+            args = [v for k in chunk for v in k]
+            if self._debug:
+                print('%s <= %s'%(stmt, args))
+            found.update(r[0] for r in self._conn.execute(stmt, args))
+        return found
+
     def _get_wheres(self, **params):
-        ks = params.keys()
-        ws = [self._cond_map({k:params[k]}) if any([isinstance(params[k], dict), params[k] is None]) else '{0}=:{0}'.format(k) for k in ks]
-        # ws = ['{0}=%({0})s'.format(k) if not any([isinstance(params[k], dict), params[k] is None]) else self._cond_map({k:params[k]}) for k in ks]
-        ws.append('1=1')
-        ws = ' AND '.join(ws)
-        return ws
-
-    def _cond_map(self, o):
-        hm = {
-            None: '%s IS NULL',
-            'like': '%s LIKE %s',
-            '<>': '%s <> %s',
-            '>': '%s > %s',
-            '>=': '%s >= %s',
-            '<': '%s < %s',
-            '<=': '%s <= %s',
-        }
-        fld, val = list(o.items())[0]
-        k, v = list(val.items())[0] if isinstance(val, dict) else (None, None)
-        k = k if k is None else k.lower()
-        if k is None:
-            s = hm[k] % fld
-        elif k == 'or':
-            s = ' OR '.join([f'{fld}="{t}"' if isinstance(t, str) else f'{fld}={t}' for t in v])
-        elif k == 'range':
-            vs = v[0]
-            ve = v[1]
-            vs = f'{fld}>="{vs}"' if isinstance(vs, str) else f'{fld}>={vs}'
-            ve = f'{fld}<"{ve}"' if isinstance(ve, str) else f'{fld}<{ve}'
-            s = ' AND '.join([vs, ve])
-        elif k in hm:
-            v = f'"{v}"' if isinstance(v, str) else v
-            s = hm[k] % (fld, v)
-        else:
-            s = '%s %s'%(fld, v)
-        if s:
-            s = f'({s})'
-        return s
+        return sqlcond.compile_wheres(params, 'named')
 
     def _get_keyflds(self, keyflds):
-        ws = ['{0}=:{0}'.format(k) if isinstance(k, str) else self._cond_map(k) for k in keyflds]
-        ws.append('1=1')
-        ws = ' AND '.join(ws)
-        return ws
+        return sqlcond.compile_keyflds(keyflds, 'named')
+
+    def _get_seek(self, keyflds):
+        # k0>v0 for one key, k0>=v0 AND (k0>v0 OR (k1>=v1 AND (k1>v1 OR ...))) for composite keys,
+        # the leading k0>=v0 keeps it an index range scan
+        s = None
+        for i in reversed(range(len(keyflds))):
+            v = ':_seek{}'.format(i)
+            gt = '{}>{}'.format(keyflds[i], v)
+            s = gt if s is None else '{0}>={1} AND ({2} OR ({3}))'.format(keyflds[i], v, gt, s)
+        return '({})'.format(s)
 
     def _exist_in_recs(self, idx, recs, keyflds):
         rec = recs[idx]
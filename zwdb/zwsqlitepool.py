@@ -0,0 +1,78 @@
+import time
+import queue
+import sqlite3
+import threading
+
+from .records import ZwdbError
+
+class ZWSqlitePool(object):
+    """Checkout based pool of sqlite3 connections, keeps the page cache and parsed schema warm"""
+    def __init__(self, connect, pool_size):
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        # signalled when a connection is put back or a slot frees up
+        self._cond = threading.Condition(self._lock)
+        self._size = 0
+        self.pool_size = pool_size
+        self.closed = False
+
+    size = property(lambda self: self._size)
+
+    def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self.closed:
+                    raise ZwdbError('Sqlite connection pool is closed.')
+                try:
+                    return self._idle.get_nowait()
+                except queue.Empty:
+                    pass
+                if self._size < self.pool_size:
+                    self._size += 1
+                    break
+                remain = None if deadline is None else deadline - time.monotonic()
+                if remain is not None and remain <= 0:
+                    raise ZwdbError('No sqlite connection available in pool after {}s.'.format(timeout))
+                self._cond.wait(remain)
+        # a free slot, connect outside the lock
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def put(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        if self.closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.put(conn)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def _discard(self, conn):
+        conn.close()
+        with self._cond:
+            self._size -= 1
+            # a waiter may open a new connection in the freed slot
+            self._cond.notify()
@@ -0,0 +1,153 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+from .records import ZwdbError
+
+class ZWSqliteWriter(object):
+    """Group commit writer, one thread applies queued writes and commits them together"""
+    _STOP = object()
+
+    def __init__(self, db, interval=0.05, max_batch=1000):
+        self._db = db
+        self._queue = queue.Queue()
+        self.interval = interval
+        self.max_batch = max_batch
+        self.commits = 0
+        self.operations = 0
+        self._lock = threading.Lock()
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='ZWSqliteWriter', daemon=True)
+        self._thread.start()
+
+    def submit(self, oper, tbl, *args, **kwargs):
+        '''Queue a connection write method (insert, update, upsert, delete), return a Future
+        resolved with its result after the batch holding it commits
+        '''
+        fut = Future()
+        with self._lock:
+            if self._error is not None:
+                raise ZwdbError('Sqlite group writer failed: {}'.format(self._error))
+            if self._closed or not self._thread.is_alive():
+                raise ZwdbError('Sqlite group writer is closed.')
+            self._queue.put((fut, oper, tbl, args, kwargs))
+        return fut
+
+    def insert(self, tbl, recs, chunk_size=None):
+        return self.submit('insert', tbl, recs, chunk_size)
+
+    def update(self, tbl, recs, keyflds):
+        return self.submit('update', tbl, recs, keyflds)
+
+    def upsert(self, tbl, recs, keyflds):
+        return self.submit('upsert', tbl, recs, keyflds)
+
+    def delete(self, tbl, recs=None, keyflds=None, **params):
+        return self.submit('delete', tbl, recs, keyflds, **params)
+
+    def flush(self):
+        '''Block until everything submitted so far is committed'''
+        self.submit(None, None).result()
+
+    def close(self):
+        with self._lock:
+            # nothing is queued behind _STOP, later submits raise
+            closed, self._closed = self._closed, True
+            if not closed:
+                self._queue.put(self._STOP)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, val, traceback):
+        self.close()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.interval
+        while batch[-1] is not self._STOP and len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        batch = []
+        try:
+            with self._db.get_connection() as conn:
+                conn.transaction = True
+                _conn = conn.conn
+                stop = False
+                while not stop:
+                    batch = self._next_batch()
+                    if batch[-1] is self._STOP:
+                        stop = True
+                        batch.pop()
+                    if not _conn.in_transaction:
+                        _conn.execute('BEGIN')
+                    self._apply(conn, batch)
+                    batch = []
+                conn.transaction = False
+        except Exception as ex:
+            # connecting or BEGIN failed, nothing queued will ever run
+            logging.error('Sqlite group writer failed: %s', ex)
+            self._fail(batch, ex)
+            return
+        # anything still queued after _STOP is never applied
+        if not self._queue.empty():
+            self._fail([], ZwdbError('Sqlite group writer is closed.'))
+
+    def _apply(self, conn, batch):
+        _conn = conn.conn
+        done = []
+        for fut, oper, tbl, args, kwargs in batch:
+            if not fut.set_running_or_notify_cancel():
+                continue
+            if oper is None:
+                done.append((fut, None, None))
+                continue
+            # a failing write only rolls back itself, not the whole batch
+            _conn.execute('SAVEPOINT zwdb_writer')
+            try:
+                r = getattr(conn, oper)(tbl, *args, **kwargs)
+                done.append((fut, r, None))
+            except Exception as ex:
+                _conn.execute('ROLLBACK TO zwdb_writer')
+                done.append((fut, None, ex))
+            _conn.execute('RELEASE zwdb_writer')
+        try:
+            _conn.commit()
+            self.commits += 1
+            self.operations += len(done)
+        except Exception as ex:
+            _conn.rollback()
+            done = [(fut, None, ex) for fut, _, _ in done]
+        for fut, r, ex in done:
+            if ex is None:
+                fut.set_result(r)
+            else:
+                fut.set_exception(ex)
+
+    def _fail(self, batch, ex):
+        with self._lock:
+            # later submits raise instead of queueing
+            self._error = ex
+        pending = list(batch)
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for item in pending:
+            if item is self._STOP or item[0].done():
+                continue
+            if item[0].running() or item[0].set_running_or_notify_cancel():
+                item[0].set_exception(ex)